@@ -63,12 +63,12 @@ class TarInfo:
 
 class TarFile:
 
-    def __init__(self, name=None, byteData=None):
+    def __init__(self, name=None, byteData=None, fileobj=None):
         self.b = byteData
         self.i = 0
-        self.f = name
+        self.f = fileobj
 
-        if self.f:
+        if name:
             self.f = open(name, "rb")
         self.subf = None
 
@@ -149,7 +149,9 @@ def writeToFile(destination, content):
 
 
 # https://github.com/micropython/micropython-lib/blob/eae01bd4e4cd1b22d9ccfedbd6bf9d879f64d9bd/shutil/shutil.py#L11
-def copyfileobj(src, dest, length=512):
+def copyfileobj(src, dest, length=None):
+    if length is None:
+        length = copyBufferSize
     if hasattr(src, "readinto"):
         buf = bytearray(length)
         while True:
@@ -173,24 +175,253 @@ def copyfileobj(src, dest, length=512):
 
 
 flashRootFolder = "/flash"
+packageDeltaFile = "package_delta.json"
+# the index of the files installed by microwave.py
+indexFile = "package.idx"
+chunksHeaderFile = "chunks.json"
+chunksReceivedFile = "received"
+# decompress the .tar.gz while extracting it, instead of writing an intermediate .tar to flash
+streamingExtract = True
+copyBufferSize = 512
+
+
+def flashPath(path):
+    return flashRootFolder.rstrip("/") + "/" + path
+
+
+def installedPackageMd5():
+    try:
+        with open(flashPath("package_md5sum.py")) as f:
+            return f.read().split('"')[1]
+    except Exception:
+        return None
+
+
+def remove(path):
+    try:
+        uos.remove(path)
+        print("Removed file: {}".format(path))
+    except OSError as e:
+        print("remove file {} failed".format(path))
+
+
+def removeIndex():
+    try:
+        uos.remove(flashPath(indexFile))
+        print("Removed file: {}".format(flashPath(indexFile)))
+    except OSError:
+        pass
+
+
+class DeltaRefused(Exception):
+    pass
+
+
+# refuses the delta package if it was not created against the installed package
+def readDelta(f):
+    try:
+        import ujson as json
+    except ImportError:
+        import json
+    delta = json.loads(f.read())
+    installed = installedPackageMd5()
+    if delta["base"] != installed:
+        raise DeltaRefused("delta package base {} does not match installed package {}".format(delta["base"], installed))
+    return delta
+
+
+try:
+    from uio import IOBase
+except ImportError:
+    try:
+        from io import IOBase
+    except ImportError:
+        IOBase = None
+
+
+# reads the chunks of a chunked package one after the other, as a single stream. Derives from IOBase, when
+# the firmware has it, so that uzlib.DecompIO can decompress it while extracting
+class ChunkReader(IOBase if IOBase else object):
+
+    def __init__(self, folder, count):
+        self.folder = folder
+        self.count = count
+        self.index = 0
+        self.f = None
+
+    def readinto(self, buf, size=None):
+        view = memoryview(buf)
+        if size is not None:
+            view = view[:size]
+        done = 0
+        while done < len(view):
+            if self.f is None:
+                if self.index >= self.count:
+                    break
+                self.f = open(self.folder + "/" + str(self.index), "rb")
+                self.index += 1
+            sz = self.f.readinto(view[done:])
+            if not sz:
+                self.f.close()
+                self.f = None
+            else:
+                done += sz
+        return done
+
+    def read(self, sz=-1):
+        if sz is None or sz < 0:
+            sz = copyBufferSize
+        buf = bytearray(sz)
+        return bytes(memoryview(buf)[:self.readinto(buf)])
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+def crc32File(path):
+    import ubinascii
+
+    crc = 0
+    size = 0
+    buf = bytearray(copyBufferSize)
+    with open(path, "rb") as f:
+        while True:
+            sz = f.readinto(buf)
+            if not sz:
+                break
+            crc = ubinascii.crc32(memoryview(buf)[:sz], crc)
+            size += sz
+    return crc, size
+
+
+# The downloader of a chunked package stores chunks.json and each chunk it receives, named by its index, in
+# the <md5>.chunks folder. Each new chunk is verified against its size and CRC32 and recorded in the
+# "received" file, so it is checked only once, and a corrupted or truncated chunk is removed to be
+# downloaded again. Returns the indexes of the verified chunks
+def verifiedChunks(folder, header):
+    received = set()
+    try:
+        with open(folder + "/" + chunksReceivedFile) as f:
+            for line in f.read().split():
+                received.add(int(line))
+    except OSError:
+        pass
+
+    for index in range(len(header["chunks"])):
+        if index in received:
+            continue
+        path = folder + "/" + str(index)
+        try:
+            uos.stat(path)
+        except OSError:
+            continue
+        chunk = header["chunks"][index]
+        if crc32File(path) == (chunk["crc32"], chunk["size"]):
+            received.add(index)
+            with open(folder + "/" + chunksReceivedFile, "a") as f:
+                f.write("{}\n".format(index))
+        else:
+            print("chunk {} is corrupted".format(index))
+            remove(path)
+    return received
+
+
+def removeChunks(folder):
+    for f in uos.listdir(folder):
+        remove(folder + "/" + f)
+    uos.rmdir(folder)
+
+
+# chunks.json comes over the same link as the chunks: its last line is the CRC32 of the JSON before it, as 8 hex
+# digits. Returns the header, or None while it is missing, truncated or corrupted, in which case it is removed
+# to be downloaded again
+def readChunksHeader(folder):
+    import ubinascii
+    try:
+        import ujson as json
+    except ImportError:
+        import json
+
+    path = folder + "/" + chunksHeaderFile
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        print("package header {} missing".format(path))
+        return None
+    try:
+        end = data.rfind(b"\n", 0, len(data) - 1)
+        if end < 0 or ubinascii.crc32(data[:end]) != int(data[end + 1:].strip(), 16):
+            raise ValueError("CRC32 mismatch")
+        return json.loads(data[:end])
+    except Exception as e:
+        print("package header {} is corrupted: {}".format(path, e))
+        remove(path)
+        return None
+
+
+# returns the reader of the chunks of a chunked package, or None when chunks are still missing
+def openChunks(folder, header):
+    received = verifiedChunks(folder, header)
+    missing = [index for index in range(len(header["chunks"])) if index not in received]
+    if missing:
+        print("package {}: {} of {} chunks missing: {}".format(header["package"], len(missing), len(header["chunks"]), missing))
+        return None
+    return ChunkReader(folder, len(header["chunks"]))
+
 
 is_compressed = False
 package_file = None
+chunks_folder = None
 for f in uos.listdir(flashRootFolder):
-    if f.endswith(".tar"):
+    if package_file is None and f.endswith(".tar"):
         package_file = flashRootFolder + "/" + f
-        break
-    if f.endswith(".tar.gz"):
+    elif package_file is None and f.endswith(".tar.gz"):
         package_file = flashRootFolder + "/" + f
         is_compressed = True
-        break
+    elif chunks_folder is None and f.endswith(".chunks"):
+        chunks_folder = flashRootFolder + "/" + f
+
+# a whole package is applied first, a chunked one once its header and all its chunks are verified
+chunk_reader = None
+header = None
+if package_file is None and chunks_folder:
+    header = readChunksHeader(chunks_folder)
+if header:
+    chunk_reader = openChunks(chunks_folder, header)
+    if chunk_reader:
+        package_file = flashRootFolder + "/" + header["package"]
+        is_compressed = package_file.endswith(".tar.gz")
+        # without IOBase the chunks are joined into the package file first
+        if is_compressed and not (streamingExtract and IOBase):
+            copyfileobj(chunk_reader, open(package_file, "wb"))
+            removeChunks(chunks_folder)
+            chunk_reader = None
 
 print("package file found: {}, is_compressed: {}".format(package_file, is_compressed))
 
 if package_file:
     t = None
+    package_stream = None
     try:
-        if is_compressed:
+        if chunk_reader and is_compressed:
+            import uzlib
+            package_stream = chunk_reader
+            # skip the 8 header bytes, the zlib stream follows
+            package_stream.read(8)
+            t = TarFile(fileobj=uzlib.DecompIO(package_stream))
+        elif chunk_reader:
+            package_stream = chunk_reader
+            t = TarFile(fileobj=chunk_reader)
+        elif is_compressed and streamingExtract:
+            import uzlib
+            package_stream = open(package_file, "rb")
+            # skip the 8 header bytes, the zlib stream follows
+            package_stream.read(8)
+            t = TarFile(fileobj=uzlib.DecompIO(package_stream))
+        elif is_compressed:
             data = readFromFile(package_file)
             import uzlib
             byteData = uzlib.decompress(data[8:])
@@ -203,19 +434,49 @@ if package_file:
             byteData = bytearray(0)
             print("package file decompressed")
 
-        t = TarFile(name=package_file)
+        if t is None:
+            t = TarFile(name=package_file)
 
         print("tar file opened: " + package_file)
 
+        delta = None
+        index_removed = False
         for i in t:
             if i.name != "././@PaxHeader":
                 print(i)
             if i.type == DIRTYPE:
                 mkdir(i.name)
+            elif i.name == packageDeltaFile:
+                delta = readDelta(t.extractfile(i))
             else:
+                # the package changes the files defrosted by microwave.py, which has to install all of them again
+                # from the next firmware. The delta description comes first, so a refused package keeps the index
+                if not index_removed:
+                    removeIndex()
+                    index_removed = True
                 f = t.extractfile(i)
                 copyfileobj(f, open(i.name, "w"))
-        if t:
+                # a source file left next to a precompiled one would be imported instead of it
+                if i.name.endswith(".mpy"):
+                    try:
+                        uos.stat(i.name[:-4] + ".py")
+                        remove(i.name[:-4] + ".py")
+                    except OSError:
+                        pass
+
+        if delta:
+            if delta["delete"] and not index_removed:
+                removeIndex()
+            for path in delta["delete"]:
+                remove(flashPath(path))
+
+        if package_stream:
+            package_stream.close()
+
+        if chunk_reader:
+            print("removing chunks...")
+            removeChunks(chunks_folder)
+        elif t:
             print("removing tar file...")
             uos.remove(package_file)
 
@@ -224,6 +485,18 @@ if package_file:
         print("about to reset...")
         import machine
         machine.reset()
+    except DeltaRefused as e:
+        # the refused package is removed, so that it is not tried again on every boot and does not hide a
+        # package pushed after it. The delta description comes first, so nothing was extracted
+        print("refused update package {}: {}".format(package_file, e))
+        if package_stream:
+            package_stream.close()
+        elif t and t.f:
+            t.f.close()
+        if chunk_reader:
+            removeChunks(chunks_folder)
+        else:
+            remove(package_file)
     except Exception as e:
         print("error unpacking update package: {}".format(package_file))
         sys.print_exception(e)
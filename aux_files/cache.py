@@ -0,0 +1,165 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from os.path import join, expanduser
+
+# bump when the format of the stored payloads changes
+CACHE_VERSION = 7
+
+
+# Least recently used entries of a BuildCache kept in memory, shared by the builds of the build daemon
+# so that the payloads of unchanged files do not need to be read from disk again
+class MemoryCache():
+    def __init__(self, max_size=64 * 1024 * 1024):
+        from collections import OrderedDict
+
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_size:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Content addressed store of transformed file payloads. Entries are keyed by the hash of
+# the source contents plus the options that affect the transformation, and the least
+# recently used entries are evicted once the cache grows beyond its size cap.
+class BuildCache():
+    def __init__(self, cache_dir=None, max_size=256 * 1024 * 1024, memory=None):
+        self.cache_dir = expanduser(cache_dir if cache_dir else "~/.cache/microfreezer")
+        self.max_size = max_size
+        self.memory = memory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, contents, *options):
+        hash = hashlib.sha256()
+        hash.update(repr((CACHE_VERSION,) + options).encode("utf-8"))
+        hash.update(b"\0")
+        hash.update(contents)
+        return hash.hexdigest()
+
+    def entryPath(self, key):
+        return join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        if self.memory is not None:
+            data = self.memory.get(key)
+            if data is not None:
+                self.hits += 1
+                return data
+        path = self.entryPath(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the modification time is used as the last access time for the LRU eviction
+            os.utime(path)
+            self.hits += 1
+            if self.memory is not None:
+                self.memory.put(key, data)
+            return data
+        except OSError:
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        if self.memory is not None:
+            self.memory.put(key, data)
+        path = self.entryPath(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # unique per process and thread, as concurrent builds can store the same entry
+            tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            logging.debug("[cache]: failed to store entry {}".format(key))
+
+    # records are a json object with the metadata of a payload, followed by the payload bytes
+    def getRecord(self, key):
+        data = self.get(key)
+        if data is None:
+            return None
+        header, payload = data.split(b"\n", 1)
+        record = json.loads(header)
+        record["payload"] = payload
+        return record
+
+    def putRecord(self, key, record):
+        header = {k: v for k, v in record.items() if k != "payload"}
+        self.put(key, json.dumps(header).encode("utf-8") + b"\n" + record["payload"])
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for directory, _, files in os.walk(self.cache_dir):
+            for f in files:
+                path = join(directory, f)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        if total_size <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+        logging.debug("[cache]: evicted entries, size is now {} bytes".format(total_size))
+
+    def logStats(self):
+        logging.info("[cache]: hits: {}, misses: {}".format(self.hits, self.misses))
@@ -24,10 +24,14 @@ from os import path
 
 
 class Config():
+    # the configuration can also be given as a dict instead of the path of its file
     def __init__(self, config_file='config.json'):
-        self.config_file_name = config_file
+        self.config_file_name = config_file if not isinstance(config_file, dict) else None
         self.app_config = {}
-        self.loadConfiguration()
+        if isinstance(config_file, dict):
+            self.app_config = dict(config_file)
+        else:
+            self.loadConfiguration()
 
     def get(self, key, defaultValue=None):
         if key in self.app_config:
@@ -52,3 +56,14 @@ class Config():
         else:
             logging.basicConfig(
                 format=FORMATTER, level=logging.INFO)
+
+
+# the configuration of one of the "targets" or "variants" of a configuration: the keys of the target override
+# the ones of the base configuration
+class TargetConfig(Config):
+    def __init__(self, base, target):
+        self.config_file_name = base.config_file_name
+        self.app_config = {key: value for key, value in base.app_config.items() if key not in ("targets", "variants")}
+        for key, value in target.items():
+            if key not in ("name", "type", "destination", "base", "overlay", "remove"):
+                self.app_config[key] = value
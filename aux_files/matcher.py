@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import re
+
+GLOB_CHARACTERS = "*?[!"
+
+
+# translates the glob syntax of gitignore to a regular expression: "*" and "?" do not match "/",
+# "**/" matches any number of folders and a trailing "/**" everything inside a folder
+def translateGlob(pattern):
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**/", i):
+                out.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern.startswith("**", i):
+                out.append(".*" if i + 2 == n else "[^/]*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2 if pattern.startswith("[!", i) or pattern.startswith("[]", i) else i + 1)
+            if end < 0:
+                out.append("\\[")
+            else:
+                content = pattern[i + 1 : end].replace("\\", "\\\\")
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                out.append("[" + content + "]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+# Matches paths relative to the project root against gitignore-style patterns, compiled once:
+#   * a pattern without a "/" matches a file or folder name at any depth, otherwise the whole path
+#     from the root, a leading "/" only anchors the pattern
+#   * a trailing "/" matches folders only
+#   * "!" re-includes the paths excluded by a previous pattern, as the last matching pattern wins
+#   * the files inside a matching folder match too
+class PathMatcher():
+    def __init__(self, patterns=()):
+        self.rules = []
+        self.add(patterns)
+
+    def add(self, patterns):
+        for pattern in patterns:
+            rule = self.compile(pattern)
+            if rule is not None:
+                self.rules.append(rule)
+
+    # reads the patterns of a .gitignore file, if it exists
+    def addFile(self, path):
+        try:
+            with open(path) as f:
+                self.add(f.read().splitlines())
+            return True
+        except OSError:
+            return False
+
+    def compile(self, pattern):
+        if pattern.endswith("\\ "):
+            pattern = pattern[:-2].rstrip() + "\\ "
+        else:
+            pattern = pattern.rstrip()
+        if not pattern or pattern.startswith("#"):
+            return None
+
+        negated = pattern.startswith("!")
+        if negated:
+            pattern = pattern[1:]
+        elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+            pattern = pattern[1:]
+        directoryOnly = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        if not pattern:
+            return None
+
+        regex = translateGlob(pattern)
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        return (negated, directoryOnly, re.compile(regex), re.compile(regex + "/.*"))
+
+    # returns True when the path is excluded by the patterns, path being relative to the root with "/" separators
+    def match(self, path, isDirectory=False):
+        for negated, directoryOnly, exact, inside in reversed(self.rules):
+            if inside.fullmatch(path) or (exact.fullmatch(path) and (isDirectory or not directoryOnly)):
+                return not negated
+        return False
+
+    def __bool__(self):
+        return bool(self.rules)
+
+
+def isPattern(entry):
+    return entry.startswith("/") or any(c in entry for c in GLOB_CHARACTERS)
+
+
+# The minifyExcludeFolderList and precompileExcludeList entries: plain entries match as substrings of the
+# path of a file, as they always did, through a single compiled expression, and entries with glob
+# characters or a leading "/" as patterns of the path in the project
+class ExcludeList():
+    def __init__(self, entries):
+        plain = [entry for entry in entries if not isPattern(entry)]
+        self.substrings = re.compile("|".join(re.escape(entry) for entry in plain)) if plain else None
+        self.patterns = PathMatcher([entry for entry in entries if isPattern(entry)])
+
+    def match(self, path, relativePath):
+        if self.substrings is not None and self.substrings.search(path):
+            return True
+        return self.patterns.match(relativePath)
@@ -26,6 +26,11 @@ import ubinascii
 
 
 enableZlibCompression = True
+# "base64": DATA is a base64 string, "bytes": DATA is a bytes literal that needs no decoding
+encoding = "base64"
+# "module": one base64_<n>.py module per file, "bundle": bundle_<n>.py modules with many files each
+layout = "module"
+indexFile = "/flash/package.idx"
 
 
 def writeToFile(destination, content):
@@ -34,9 +39,11 @@ def writeToFile(destination, content):
         out_file.write(content)
         out_file.close()
         print("file [{}] write finished.".format(destination))
+        return True
     except Exception as e:
         print("file [{}] write failed.".format(destination))
         sys.print_exception(e)
+        return False
 
 
 def recursiveMkdir(absolutePath):
@@ -66,26 +73,178 @@ def remove(directoryPath):
         print("remove file {} failed".format(directoryPath))
 
 
+def fileExists(path):
+    try:
+        uos.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def fileSize(path):
+    try:
+        return uos.stat(path)[6]
+    except OSError:
+        return None
+
+
+# index of the installed files, one "<hash> <size> <path>" line per file. Later lines override
+# earlier ones, since a line is appended every time a file is written. _apply_package.py removes
+# the index when it changes the files, and lines of other formats are ignored
+def loadIndex():
+    index = {}
+    try:
+        with open(indexFile) as f:
+            for line in f:
+                parts = line.rstrip("\n").split(" ", 2)
+                if len(parts) == 3 and parts[1].isdigit():
+                    index[parts[2]] = (parts[0], int(parts[1]))
+    except OSError:
+        pass
+    return index
+
+
+def appendToIndex(path, entry):
+    try:
+        with open(indexFile, "a") as f:
+            f.write("{} {} {}\n".format(entry[0], entry[1], path))
+    except Exception as e:
+        print("index update failed: {}".format(path))
+        sys.print_exception(e)
+
+
+def saveIndex(index):
+    try:
+        with open(indexFile, "w") as f:
+            for path in index:
+                f.write("{} {} {}\n".format(index[path][0], index[path][1], path))
+    except Exception as e:
+        print("index write failed")
+        sys.print_exception(e)
+
+
+# a file is skipped only if it still has the size it was written with, as the application may have changed it
+def isUnchanged(index, path, file_hash):
+    entry = index.get(path)
+    return file_hash is not None and entry is not None and entry[0] == file_hash and fileSize(path) == entry[1]
+
+
+def decodeData(data):
+    if encoding == "bytes":
+        return data
+    return ubinascii.a2b_base64(data)
+
+
+def recordFile(index, path, file_hash, written):
+    # a source file left next to a precompiled one would be imported instead of it
+    if written and path.endswith(".mpy") and fileExists(path[:-4] + ".py"):
+        remove(path[:-4] + ".py")
+    if written and file_hash is not None:
+        index[path] = (file_hash, fileSize(path))
+        appendToIndex(path, index[path])
+        return True
+    return False
+
+
+# writes the payload of a file and records it in the index, returns True if the index changed
+def installFile(index, path, file_hash, payload, codec):
+    recursiveMkdir(path)
+    if codec == "zlib":
+        payload = uzlib.decompress(payload)
+    written = writeToFile(path, payload)
+    del payload
+    return recordFile(index, path, file_hash, written)
+
+
+# decodes, decompresses and appends one chunk at a time, so RAM use is bounded by the chunk size
+def installChunkedFile(index, path, file_hash, chunks, codec):
+    import gc
+    recursiveMkdir(path)
+    written = False
+    try:
+        out_file = open(path, "wb")
+        for chunk in chunks:
+            chunk = decodeData(chunk)
+            if codec == "zlib":
+                chunk = uzlib.decompress(chunk)
+            out_file.write(chunk)
+            del chunk
+            gc.collect()
+        out_file.close()
+        written = True
+        print("file [{}] write finished.".format(path))
+    except Exception as e:
+        print("file [{}] write failed.".format(path))
+        sys.print_exception(e)
+    return recordFile(index, path, file_hash, written)
+
+
+def defrostModule(name, index):
+    x = __import__(name, globals(), locals(), ['PATH', 'DATA', 'HASH', 'CODEC'])
+    file_hash = getattr(x, "HASH", None)
+    index_changed = False
+    if isUnchanged(index, x.PATH, file_hash):
+        print("    File: " + name + ", unchanged")
+    else:
+        codec = getattr(x, "CODEC", "zlib" if enableZlibCompression else "store")
+        if isinstance(x.DATA, tuple):
+            index_changed = installChunkedFile(index, x.PATH, file_hash, x.DATA, codec)
+        else:
+            index_changed = installFile(index, x.PATH, file_hash, decodeData(x.DATA), codec)
+        print("    File: " + name + ", success")
+    del x
+    return index_changed
+
+
+# bundles hold the payloads of many files, each INDEX entry is (path, offset, length, codec, hash).
+# A chunked file has a bundle of its own, with DATA being the tuple of its chunks. The DATA of a solid
+# block has CODEC="zlib": it is decompressed as a whole and the INDEX points into the decompressed data
+def defrostBundle(name, index):
+    x = __import__(name, globals(), locals(), ['INDEX', 'DATA', 'CODEC'])
+    data = None
+    index_changed = False
+    for path, offset, length, codec, file_hash in x.INDEX:
+        if isUnchanged(index, path, file_hash):
+            print("    File: " + path + ", unchanged")
+            continue
+        if isinstance(x.DATA, tuple):
+            index_changed = installChunkedFile(index, path, file_hash, x.DATA, codec)
+            print("    File: " + path + ", success")
+            continue
+        # the bundle is decoded only once, and only if any of its files changed
+        if data is None:
+            data = decodeData(x.DATA)
+            if getattr(x, "CODEC", "store") == "zlib":
+                data = uzlib.decompress(data)
+            data = memoryview(data)
+        if installFile(index, path, file_hash, data[offset:offset + length], codec):
+            index_changed = True
+        print("    File: " + path + ", success")
+    del data
+    del x
+    return index_changed
+
+
 def defrost(defrost_module_name="_todefrost", delete_file_after_operation=False):
     file_index = 0
     module_found = True
     print("Starting defrosting...")
     import gc
+    index = loadIndex()
+    index_changed = False
+    module_prefix = "bundle_" if layout == "bundle" else "base64_"
     while module_found:
-        name = defrost_module_name + ".base64_" + str(file_index)
-        file_name = "{}/base64_{}.py".format(defrost_module_name, str(file_index))
+        name = defrost_module_name + "." + module_prefix + str(file_index)
+        file_name = "{}/{}{}.py".format(defrost_module_name, module_prefix, str(file_index))
         gc.collect()
         print("Processing file: {}, free_mem: {}".format(name, gc.mem_free()))
         try:
-            x = __import__(name, globals(), locals(), ['PATH', 'DATA'])
-            recursiveMkdir(x.PATH)
-            ascii_data = ubinascii.a2b_base64(x.DATA)
-            if enableZlibCompression:
-                ascii_data = uzlib.decompress(ascii_data)
-            writeToFile(x.PATH, ascii_data)
-            del x
+            if layout == "bundle":
+                changed = defrostBundle(name, index)
+            else:
+                changed = defrostModule(name, index)
+            index_changed = index_changed or changed
             sys.modules.pop(name)
-            print("    File: " + name + ", success")
             if delete_file_after_operation:
                 remove(file_name)
             file_index += 1
@@ -93,6 +252,10 @@ def defrost(defrost_module_name="_todefrost", delete_file_after_operation=False)
             sys.print_exception(e)
             module_found = False
 
+    # rewrite the index to drop the lines that were overridden during this run
+    if index_changed:
+        saveIndex(index)
+
     # in case any file gets properly defrosted, the file_index will increase,
     # so it is used as a quick way of assuming operation success
     if file_index > 0:
@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# The stages that transform the contents of each file in memory, before it is compressed and
+# encoded for the device. A stage is called with the file being processed, a dict with its
+# "sourceFile", "destFile" (relative to the project root) and "payload" (bytes), along with the
+# options of the stage from the configuration, and returns the file. Stages are registered by name:
+#
+#     from aux_files.pipeline import registerStage
+#
+#     @registerStage("strip_comments")
+#     def stripComments(file, options):
+#         file["payload"] = ...
+#         return file
+#
+# and the modules that register them are listed in the "pipelinePlugins" key of the configuration.
+
+import importlib
+import logging
+import os
+from os.path import join
+import aux_files.profiler as profiler
+
+STAGES = {}
+
+
+def registerStage(name):
+    def register(function):
+        STAGES[name] = function
+        return function
+
+    return register
+
+
+# imports the modules that register stages, in the worker processes too
+def loadPlugins(plugins):
+    for plugin in plugins:
+        importlib.import_module(plugin)
+
+
+def pluginVersions(plugins):
+    import sys
+
+    loadPlugins(plugins)
+    return tuple(getattr(sys.modules[plugin], "__version__", None) for plugin in plugins)
+
+
+def stageNames(stages):
+    return [name for name, _ in stages]
+
+
+# runs the stages, given as (name, options) pairs, over the contents of sourceFile
+def runPipeline(sourceFile, destFile, stages, plugins=()):
+    loadPlugins(plugins)
+    with open(sourceFile, "rb") as f:
+        file = {"sourceFile": sourceFile, "destFile": destFile, "payload": f.read(), "precompiled": False}
+    for name, options in stages:
+        if name not in STAGES:
+            raise ValueError("unknown pipeline stage: {}".format(name))
+        file = profiler.call(name, STAGES[name], file, options, bytesIn=len(file["payload"]))
+    return file
+
+
+def minifySource(source):
+    import python_minifier
+
+    return python_minifier.minify(
+        source,
+        remove_annotations=True,
+        remove_pass=False,
+        remove_literal_statements=True,
+        combine_imports=True,
+        hoist_literals=True,
+        rename_locals=True,
+        preserve_locals=None,
+        rename_globals=False,
+        preserve_globals=None,
+        remove_object_base=False,
+        convert_posargs_to_args=False,
+        preserve_shebang=True,
+    )
+
+
+@registerStage("minify")
+def minify(file, options):
+    logging.debug("  [M]: " + str(file["sourceFile"]))
+    file["payload"] = minifySource(file["payload"].decode("utf-8")).encode("utf-8")
+    return file
+
+
+# compiles python source to .mpy bytecode with mpy-cross. Returns None when the compilation fails,
+# so that the source is shipped instead
+def precompileSource(contents, sourceName, mpyCrossPath, mpyCrossArgs=()):
+    import subprocess
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_file = join(tmp_dir, "source.py")
+        mpy_file = join(tmp_dir, "source.mpy")
+        with open(source_file, "wb") as f:
+            f.write(contents)
+        result = subprocess.run(
+            [mpyCrossPath] + list(mpyCrossArgs) + ["-s", sourceName, "-o", mpy_file, source_file], capture_output=True
+        )
+        if result.returncode != 0:
+            logging.warning("precompile of {} failed, shipping source: {}".format(sourceName, result.stderr.decode().strip()))
+            return None
+        with open(mpy_file, "rb") as f:
+            return f.read()
+
+
+# boot.py and main.py are run by the device from source, so they are never precompiled
+@registerStage("precompile")
+def precompile(file, options):
+    destFile = file["destFile"]
+    if not destFile.endswith(".py") or destFile in ("boot.py", "main.py"):
+        return file
+    logging.debug("  [P]: " + str(file["sourceFile"]))
+    mpy = precompileSource(
+        file["payload"],
+        os.path.basename(file["sourceFile"]),
+        options.get("mpyCrossPath", "mpy-cross"),
+        options.get("mpyCrossArgs", []),
+    )
+    if mpy is not None:
+        file["payload"] = mpy
+        file["destFile"] = destFile[: -len(".py")] + ".mpy"
+        file["precompiled"] = True
+    return file
@@ -0,0 +1,206 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# The profiler of "microfreezer.py --profile". Every measured call is an event with its name, start, wall and
+# CPU time, and the bytes it took in and gave out. The stages of a build, the tasks of the worker processes
+# and the steps inside them (pipeline stages, zlib, md5, ...) are measured with call, which only calls the
+# function when no profiler is active:
+#
+#     import aux_files.profiler as profiler
+#
+#     profiler.active = profiler.Profiler()
+#     ...
+#     compressed = profiler.call("zlib", compress, data, bytesIn=len(data))
+#
+# The tasks sent to the worker processes run through profiledCall, which profiles them in the worker and
+# sends its events back along with the result. The profiler of a task is kept per thread, so the tasks run
+# by concurrent builds never replace the profiler of another build. The events of a call include the time
+# of the calls made by it, so the times of nested events overlap.
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+# the Profiler of the running build, None when profiling is off
+active = None
+# the Profiler of the task running in a thread, see profiledCall
+taskProfiler = threading.local()
+
+
+# the bytes of the result of a measured call: bytes and strings, the payload of a file, or the bytes
+# in a tuple of results
+def sizeOf(result):
+    if isinstance(result, (bytes, bytearray, str)):
+        return len(result)
+    if isinstance(result, dict):
+        return len(result.get("payload") or b"")
+    if isinstance(result, tuple):
+        return sum(len(item) for item in result if isinstance(item, (bytes, bytearray)))
+    return 0
+
+
+# the Profiler of the task running in this thread, or else the one of the build
+def current():
+    return getattr(taskProfiler, "profiler", None) or active
+
+
+def call(name, function, *args, path=None, bytesIn=0):
+    profiler = current()
+    if profiler is None:
+        return function(*args)
+    return profiler.measure(name, function, args, path, bytesIn)
+
+
+# runs a task in a worker process with a profiler of its own and returns its result along with its events
+def profiledCall(function, *args):
+    previous = getattr(taskProfiler, "profiler", None)
+    profiler = taskProfiler.profiler = Profiler()
+    try:
+        path = args[0] if args and isinstance(args[0], str) else None
+        bytesIn = os.path.getsize(path) if path is not None and os.path.isfile(path) else 0
+        if args and isinstance(args[0], (bytes, bytearray)):
+            bytesIn = len(args[0])
+        result = profiler.measure(function.__name__, function, args, path, bytesIn)
+        return result, profiler.events
+    finally:
+        taskProfiler.profiler = previous
+
+
+class Profiler():
+    def __init__(self, top=10):
+        self.top = top
+        self.started = time.time()
+        self.events = []
+        self.lock = threading.Lock()
+
+    def measure(self, name, function, args, path=None, bytesIn=0):
+        started = time.time()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        result = function(*args)
+        self.add(
+            {
+                "name": name,
+                "path": path,
+                "started": started,
+                "wall": time.perf_counter() - wall,
+                "cpu": time.process_time() - cpu,
+                "bytesIn": bytesIn,
+                "bytesOut": sizeOf(result),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            }
+        )
+        return result
+
+    def add(self, *events):
+        with self.lock:
+            self.events.extend(events)
+
+    # the task counterparts of MicroFreezer.mapTasks and submitTask, which run the tasks through profiledCall
+    def runTask(self, function, *args):
+        result, events = profiledCall(function, *args)
+        self.add(*events)
+        return result
+
+    def mapTasks(self, pool, function, tasks, chunksize):
+        results = []
+        for result, events in pool.map(profiledCall, [function] * len(tasks), *zip(*tasks), chunksize=chunksize):
+            self.add(*events)
+            results.append(result)
+        return results
+
+    def submitTask(self, pool, function, *args):
+        future = Future()
+
+        def done(profiled):
+            if profiled.exception() is not None:
+                future.set_exception(profiled.exception())
+                return
+            result, events = profiled.result()
+            self.add(*events)
+            future.set_result(result)
+
+        pool.submit(profiledCall, function, *args).add_done_callback(done)
+        return future
+
+    def stages(self):
+        stages = {}
+        for event in self.events:
+            stage = stages.setdefault(event["name"], {"calls": 0, "bytesIn": 0, "bytesOut": 0, "wall": 0.0, "cpu": 0.0})
+            stage["calls"] += 1
+            stage["bytesIn"] += event["bytesIn"]
+            stage["bytesOut"] += event["bytesOut"]
+            stage["wall"] += event["wall"]
+            stage["cpu"] += event["cpu"]
+        return stages
+
+    # the slowest calls that processed a file, the tasks of the worker processes
+    def slowestFiles(self):
+        files = [event for event in self.events if event["path"] is not None]
+        return sorted(files, key=lambda event: event["wall"], reverse=True)[: self.top]
+
+    def asDict(self):
+        return {
+            "stages": self.stages(),
+            "slowestFiles": [
+                {"path": event["path"], "name": event["name"], "wall": event["wall"], "cpu": event["cpu"]}
+                for event in self.slowestFiles()
+            ],
+        }
+
+    def logSummary(self):
+        logging.info(
+            "[profile]: {:<24} {:>7} {:>12} {:>12} {:>9} {:>9}".format(
+                "stage", "calls", "bytes in", "bytes out", "wall s", "cpu s"
+            )
+        )
+        for name, stage in sorted(self.stages().items(), key=lambda item: item[1]["wall"], reverse=True):
+            logging.info(
+                "[profile]: {:<24} {:>7} {:>12} {:>12} {:>9.3f} {:>9.3f}".format(
+                    name, stage["calls"], stage["bytesIn"], stage["bytesOut"], stage["wall"], stage["cpu"]
+                )
+            )
+        for event in self.slowestFiles():
+            logging.info("[profile]: slowest: {:>9.4f} s  {}  {}".format(event["wall"], event["name"], event["path"]))
+
+    # the events in the trace event format of chrome://tracing and Perfetto, a row per process and thread
+    def writeChromeTrace(self, traceFile):
+        events = []
+        for event in self.events:
+            args = {"bytesIn": event["bytesIn"], "bytesOut": event["bytesOut"], "cpu": event["cpu"]}
+            if event["path"] is not None:
+                args["path"] = event["path"]
+            events.append(
+                {
+                    "name": event["name"],
+                    "ph": "X",
+                    "ts": (event["started"] - self.started) * 1e6,
+                    "dur": event["wall"] * 1e6,
+                    "pid": event["pid"],
+                    "tid": event["tid"],
+                    "args": args,
+                }
+            )
+        with open(traceFile, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
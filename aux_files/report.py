@@ -0,0 +1,150 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# The size report of a build: where each file of the project ends up and how big it is at each step.
+#
+#     frozen:    copied to Custom/ (directoriesKeptInFrozen) and frozen in the firmware as it is
+#     todefrost: frozen in the firmware as the payload of a _todefrost module, installed to flash by microwave.py
+#     tarball:   a member of the OTA package
+#
+# The sizes of a file are its source size, its size after the pipeline stages (minify, precompile, ...),
+# its compressed size and its encoded size, the bytes it takes in its container. The files of a tarball are
+# compressed as a single stream, so only the package as a whole has a compressed size.
+
+import posixpath
+
+DESTINATIONS = ("frozen", "todefrost", "tarball")
+SIZE_FIELDS = ("sourceSize", "minifiedSize", "compressedSize", "encodedSize")
+COLUMNS = {"sourceSize": "source", "minifiedSize": "minified", "compressedSize": "compressed", "encodedSize": "encoded"}
+
+
+def sumSizes(files):
+    totals = {"files": len(files)}
+    for field in SIZE_FIELDS:
+        sizes = [f[field] for f in files if f[field] is not None]
+        totals[field] = sum(sizes) if sizes else None
+    return totals
+
+
+class SizeReport():
+    def __init__(self, frozenBudget=None, otaPackageBudget=None):
+        self.frozenBudget = frozenBudget
+        self.otaPackageBudget = otaPackageBudget
+        self.files = []
+        self.packageSize = None
+
+    def addFile(self, path, destination, sourceSize, minifiedSize, compressedSize=None, encodedSize=None):
+        self.files.append(
+            {
+                "path": path,
+                "destination": destination,
+                "sourceSize": sourceSize,
+                "minifiedSize": minifiedSize,
+                "compressedSize": compressedSize,
+                "encodedSize": encodedSize,
+            }
+        )
+
+    # the firmware bytes taken by the files of the project, both the frozen ones and the _todefrost payloads
+    def frozenSize(self):
+        return sum(f["encodedSize"] for f in self.files if f["destination"] in ("frozen", "todefrost"))
+
+    def directories(self):
+        groups = {}
+        for f in self.files:
+            groups.setdefault((f["destination"], posixpath.dirname(f["path"]) or "."), []).append(f)
+        directories = []
+        for (destination, directory), files in sorted(groups.items()):
+            totals = sumSizes(files)
+            totals.update({"destination": destination, "directory": directory})
+            directories.append(totals)
+        return directories
+
+    # returns a message for each exceeded budget
+    def exceededBudgets(self):
+        exceeded = []
+        frozenSize = self.frozenSize()
+        if self.frozenBudget is not None and frozenSize > self.frozenBudget:
+            exceeded.append("frozen size of {} bytes exceeds the frozenBudget of {} bytes".format(frozenSize, self.frozenBudget))
+        if self.otaPackageBudget is not None and self.packageSize is not None and self.packageSize > self.otaPackageBudget:
+            exceeded.append(
+                "OTA package size of {} bytes exceeds the otaPackageBudget of {} bytes".format(
+                    self.packageSize, self.otaPackageBudget
+                )
+            )
+        return exceeded
+
+    def asDict(self):
+        totals = {}
+        for destination in DESTINATIONS:
+            files = [f for f in self.files if f["destination"] == destination]
+            if files:
+                totals[destination] = sumSizes(files)
+        # the files of a tarball are compressed together, into the package
+        if "tarball" in totals and self.packageSize is not None:
+            totals["tarball"]["compressedSize"] = self.packageSize
+        return {
+            "files": sorted(self.files, key=lambda f: (f["destination"], f["path"])),
+            "directories": self.directories(),
+            "totals": totals,
+            "frozenSize": self.frozenSize(),
+            "frozenBudget": self.frozenBudget,
+            "packageSize": self.packageSize,
+            "otaPackageBudget": self.otaPackageBudget,
+        }
+
+
+def formatSize(size):
+    return "-" if size is None else str(size)
+
+
+def formatRow(destination, name, sizes):
+    return "{:<10} {:<40} {:>10} {:>10} {:>10} {:>10}".format(
+        destination, name, *(formatSize(sizes[field]) for field in SIZE_FIELDS)
+    )
+
+
+def formatBudget(name, size, budget):
+    if budget is None:
+        return "{}: {} bytes".format(name, size)
+    return "{}: {} of {} bytes ({:.1%}){}".format(
+        name, size, budget, size / budget if budget else 0.0, ", EXCEEDED" if size > budget else ""
+    )
+
+
+# the report of SizeReport.asDict as a readable table
+def formatReport(report):
+    lines = [formatRow("dest", "path", COLUMNS)]
+    for f in report["files"]:
+        lines.append(formatRow(f["destination"], f["path"], f))
+    lines.append("")
+    lines.append(formatRow("dest", "directory", COLUMNS))
+    for directory in report["directories"]:
+        name = "{}/ ({} files)".format(directory["directory"], directory["files"])
+        lines.append(formatRow(directory["destination"], name, directory))
+    lines.append("")
+    for destination, totals in report["totals"].items():
+        lines.append(formatRow(destination, "total ({} files)".format(totals["files"]), totals))
+    lines.append("")
+    if any(destination in report["totals"] for destination in ("frozen", "todefrost")):
+        lines.append(formatBudget("frozen partition", report["frozenSize"], report["frozenBudget"]))
+    if report["packageSize"] is not None:
+        lines.append(formatBudget("OTA package", report["packageSize"], report["otaPackageBudget"]))
+    return "\n".join(lines)
@@ -0,0 +1,210 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# The build daemon of "microfreezer.py serve" and its protocol. A client connects to the unix socket
+# and sends a request as a single line of json, then reads the response, a single line of json too:
+#
+#     {"command": "build", "source": ..., "destination": ..., "config": ..., "otaPackage": false, "base": ..., "noCache": false}
+#     {"command": "stats"}
+#
+# The paths of a request must be absolute, as the daemon runs in a working directory of its own. A build
+# is answered with its BuildResult as a dict, along with the time it waited for a worker and its latency.
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+RECENT_REQUESTS = 20
+
+
+def defaultSocketPath():
+    runtimeDir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtimeDir:
+        return join(runtimeDir, "microfreezer.sock")
+    return "/tmp/microfreezer-{}.sock".format(os.getuid())
+
+
+def sendMessage(stream, message):
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    stream.flush()
+
+
+def receiveMessage(stream):
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("connection closed before a message was received")
+    return json.loads(line)
+
+
+# sends a request to the daemon listening on socketPath and returns its response
+def request(socketPath, message):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socketPath)
+        with sock.makefile("rwb") as stream:
+            sendMessage(stream, message)
+            return receiveMessage(stream)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = receiveMessage(self.rfile)
+            response = self.server.buildServer.handle(message)
+        except Exception as e:
+            logging.exception("[serve]: request failed")
+            response = {"ok": False, "errors": ["{}: {}".format(type(e).__name__, e)]}
+        try:
+            sendMessage(self.wfile, response)
+        except OSError:
+            logging.debug("[serve]: the client went away before the response")
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Accepts build requests on a unix socket and runs them with the build function, a request at a time on
+# each of its worker threads, so that concurrent requests queue for a free worker. The builds of the
+# same destination are serialized. memoryCache is reported in the statistics, when given
+class BuildServer():
+    def __init__(self, socketPath, build, workers=2, memoryCache=None):
+        self.socketPath = socketPath
+        self.build = build
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="build")
+        self.memoryCache = memoryCache
+        self.lock = threading.Lock()
+        self.destinationLocks = {}
+        self.started = time.time()
+        self.requests = 0
+        self.failed = 0
+        self.active = 0
+        self.totalLatency = 0.0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.recent = deque(maxlen=RECENT_REQUESTS)
+
+    def handle(self, message):
+        command = message.get("command", "build")
+        if command == "stats":
+            return self.statistics()
+        if command == "build":
+            received = time.perf_counter()
+            return self.executor.submit(self.runBuild, message, received).result()
+        return {"ok": False, "errors": ["unknown command: {}".format(command)]}
+
+    def destinationLock(self, destination):
+        with self.lock:
+            return self.destinationLocks.setdefault(os.path.abspath(destination), threading.Lock())
+
+    def runBuild(self, message, received):
+        started = time.perf_counter()
+        with self.lock:
+            self.active += 1
+        try:
+            with self.destinationLock(message["destination"]):
+                response = self.build(message)
+        finally:
+            with self.lock:
+                self.active -= 1
+        finished = time.perf_counter()
+        response["queueTime"] = started - received
+        response["latency"] = finished - received
+
+        with self.lock:
+            self.requests += 1
+            if not response["ok"]:
+                self.failed += 1
+            self.totalLatency += response["latency"]
+            self.cacheHits += response["cacheHits"]
+            self.cacheMisses += response["cacheMisses"]
+            self.recent.append(
+                {
+                    "source": message["source"],
+                    "destination": message["destination"],
+                    "ok": response["ok"],
+                    "latency": response["latency"],
+                    "queueTime": response["queueTime"],
+                    "cacheHits": response["cacheHits"],
+                    "cacheMisses": response["cacheMisses"],
+                }
+            )
+        logging.info(
+            "[serve]: built {} in {:.3f} s ({:.3f} s queued), cache hits: {}, misses: {}".format(
+                message["source"], response["latency"], response["queueTime"], response["cacheHits"], response["cacheMisses"]
+            )
+        )
+        return response
+
+    def statistics(self):
+        with self.lock:
+            lookups = self.cacheHits + self.cacheMisses
+            stats = {
+                "ok": True,
+                "uptime": time.time() - self.started,
+                "workers": self.workers,
+                "active": self.active,
+                "requests": self.requests,
+                "failed": self.failed,
+                "averageLatency": self.totalLatency / self.requests if self.requests else 0.0,
+                "cacheHits": self.cacheHits,
+                "cacheMisses": self.cacheMisses,
+                "cacheHitRatio": self.cacheHits / lookups if lookups else 0.0,
+                "recent": list(self.recent),
+            }
+        if self.memoryCache is not None:
+            stats["memoryCacheEntries"] = len(self.memoryCache)
+            stats["memoryCacheSize"] = self.memoryCache.size
+        return stats
+
+    # a socket left behind by a daemon that did not exit cleanly is replaced, unless a daemon still answers on it
+    def removeStaleSocket(self):
+        if not os.path.exists(self.socketPath):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self.socketPath)
+            except OSError:
+                os.remove(self.socketPath)
+                return
+        raise OSError("a build daemon is already listening on {}".format(self.socketPath))
+
+    def serveForever(self):
+        self.removeStaleSocket()
+        server = UnixServer(self.socketPath, RequestHandler)
+        server.buildServer = self
+        os.chmod(self.socketPath, 0o600)
+        logging.info("[serve]: listening on {} with {} workers".format(self.socketPath, self.workers))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info("[serve]: stopped")
+        finally:
+            server.server_close()
+            self.executor.shutdown()
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
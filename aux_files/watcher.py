@@ -0,0 +1,195 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+import os
+import sys
+import time
+from os.path import join, relpath
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+
+# watches every directory of a tree with the inotify API of linux, through ctypes
+class InotifyWatcher():
+    def __init__(self, root, isIgnored):
+        import ctypes
+        import ctypes.util
+        import struct
+
+        self.root = root
+        self.isIgnored = isIgnored
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.eventHeader = struct.Struct("iIII")
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        try:
+            self.addTree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def addTree(self, root):
+        import ctypes
+
+        for directory, dirs, _ in os.walk(root):
+            dirs[:] = [d for d in dirs if not self.isIgnored(join(directory, d))]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                # ENOSPC when the tree needs more than fs.inotify.max_user_watches
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed for {}".format(directory))
+            self.watches[wd] = directory
+
+    # returns the paths changed within timeout seconds
+    def poll(self, timeout):
+        import select
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.fd, 65536)
+        changes = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.eventHeader.unpack_from(data, offset)
+            name = data[offset + self.eventHeader.size : offset + self.eventHeader.size + length].rstrip(b"\0")
+            offset += self.eventHeader.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.append(self.root)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd)
+                continue
+
+            path = join(directory, os.fsdecode(name)) if name else directory
+            if self.isIgnored(path):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.addTree(path)
+                except OSError:
+                    logging.debug("[watch]: unable to watch {}".format(path))
+            changes.append(path)
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+# compares the modification time and size of every file of a tree with the previous scan
+class PollingWatcher():
+    def __init__(self, root, isIgnored, interval=0.5):
+        self.root = root
+        self.isIgnored = isIgnored
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for directory, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not self.isIgnored(join(directory, d))]
+            for f in files:
+                path = join(directory, f)
+                if self.isIgnored(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.interval) if timeout is not None else self.interval)
+        snapshot = self.scan()
+        changes = [path for path in set(snapshot) | set(self.snapshot) if snapshot.get(path) != self.snapshot.get(path)]
+        self.snapshot = snapshot
+        return changes
+
+    def close(self):
+        pass
+
+
+# Waits for changes in the source tree of a project. Uses inotify on linux and falls back to polling
+# elsewhere, or when inotify is not usable. Paths excluded by matcher (a PathMatcher), or inside one
+# of the ignoredDirs (like the destination folder), are not watched
+class SourceWatcher():
+    def __init__(self, root, matcher=None, ignoredDirs=(), interval=0.5, debounce=0.2):
+        self.root = os.path.abspath(root)
+        self.matcher = matcher
+        self.ignoredDirs = [os.path.abspath(d) for d in ignoredDirs]
+        self.debounce = debounce
+        self.watcher = None
+        if sys.platform.startswith("linux"):
+            try:
+                self.watcher = InotifyWatcher(self.root, self.isIgnored)
+                logging.info("[watch]: watching {} with inotify".format(self.root))
+            except (OSError, AttributeError) as e:
+                logging.info("[watch]: inotify is not available ({}), polling instead".format(e))
+        if self.watcher is None:
+            self.watcher = PollingWatcher(self.root, self.isIgnored, interval)
+            logging.info("[watch]: polling {} every {} seconds".format(self.root, interval))
+
+    def isIgnored(self, path):
+        path = os.path.abspath(path)
+        for directory in self.ignoredDirs:
+            if path == directory or path.startswith(directory + os.sep):
+                return True
+        if self.matcher is None or path == self.root:
+            return False
+        return self.matcher.match(relpath(path, self.root).replace(os.sep, "/"), os.path.isdir(path))
+
+    # blocks until something changes, then waits for the changes to settle for debounce seconds, so
+    # that a save touching several files triggers a single rebuild. Returns the changed paths
+    def wait(self):
+        changes = set()
+        while not changes:
+            changes.update(self.watcher.poll(None))
+        while True:
+            more = self.watcher.poll(self.debounce)
+            if not more:
+                break
+            changes.update(more)
+        return sorted(changes)
+
+    def close(self):
+        self.watcher.close()
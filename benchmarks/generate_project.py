@@ -0,0 +1,151 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Generates synthetic micropython projects of different shapes for benchmarking microfreezer.
+# The projects are deterministic for a given shape, scale and seed.
+
+import os
+import random
+from os.path import join
+
+MODULE_TEMPLATE = '''import time
+from machine import Pin
+
+# {comment}
+CONFIG_{index} = {{"name": "module_{index}", "interval": {interval}, "enabled": True}}
+
+
+class Sensor{index}:
+    """Reads sensor {index} and keeps the last {interval} values."""
+
+    def __init__(self, pin={pin}):
+        self.pin = Pin(pin, Pin.IN)
+        self.values = []
+
+    def read(self):
+        value = self.pin.value() * {factor}
+        self.values.append(value)
+        if len(self.values) > {interval}:
+            self.values.pop(0)
+        return value
+
+    def average(self):
+        return sum(self.values) / len(self.values) if self.values else 0
+'''
+
+WORDS = ["sensor", "network", "modem", "battery", "reading", "upload", "sleep", "config", "retry", "timeout"]
+
+
+def writeModule(path, rnd, index):
+    with open(path, "w") as f:
+        f.write(
+            MODULE_TEMPLATE.format(
+                comment=" ".join(rnd.choice(WORDS) for _ in range(12)),
+                index=index,
+                interval=rnd.randint(5, 100),
+                pin=rnd.randint(0, 39),
+                factor=rnd.randint(1, 10),
+            )
+        )
+
+
+def writeText(path, rnd, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rnd.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    with open(path, "w") as f:
+        f.write(" ".join(words)[:size])
+
+
+# random bytes do not compress, like images and already compressed files
+def writeBinary(path, rnd, size):
+    with open(path, "wb") as f:
+        f.write(rnd.randbytes(size))
+
+
+def generateTinyModules(root, rnd, scale):
+    for i in range(400 * scale):
+        directory = join(root, "lib", "pkg{}".format(i // 50))
+        os.makedirs(directory, exist_ok=True)
+        writeModule(join(directory, "mod{}.py".format(i)), rnd, i)
+    writeModule(join(root, "main.py"), rnd, 0)
+
+
+def generateHugeAssets(root, rnd, scale):
+    os.makedirs(join(root, "www"), exist_ok=True)
+    for i in range(3):
+        writeText(join(root, "www", "bundle{}.js".format(i)), rnd, 1024 * 1024 * scale)
+    writeBinary(join(root, "www", "model.bin"), rnd, 512 * 1024 * scale)
+    writeModule(join(root, "main.py"), rnd, 0)
+
+
+def generateDeepTree(root, rnd, scale):
+    for branch in range(4 * scale):
+        directory = root
+        for depth in range(12):
+            directory = join(directory, "level{}_{}".format(depth, branch))
+            os.makedirs(directory, exist_ok=True)
+            writeModule(join(directory, "node.py"), rnd, depth)
+            writeText(join(directory, "notes.txt"), rnd, 256)
+    writeModule(join(root, "main.py"), rnd, 0)
+
+
+def generateMixed(root, rnd, scale):
+    os.makedirs(join(root, "lib"), exist_ok=True)
+    os.makedirs(join(root, "html"), exist_ok=True)
+    os.makedirs(join(root, "certs"), exist_ok=True)
+    for i in range(60 * scale):
+        writeModule(join(root, "lib", "mod{}.py".format(i)), rnd, i)
+    for i in range(20 * scale):
+        writeText(join(root, "html", "page{}.html".format(i)), rnd, rnd.randint(2048, 32768))
+    for i in range(10 * scale):
+        writeBinary(join(root, "html", "image{}.png".format(i)), rnd, rnd.randint(1024, 65536))
+    for i in range(4):
+        writeBinary(join(root, "certs", "device{}.der".format(i)), rnd, 1200)
+    writeModule(join(root, "main.py"), rnd, 0)
+    writeModule(join(root, "boot.py"), rnd, 1)
+
+
+SHAPES = {
+    "tiny_modules": generateTinyModules,
+    "huge_assets": generateHugeAssets,
+    "deep_tree": generateDeepTree,
+    "mixed": generateMixed,
+}
+
+
+def generateProject(shape, root, scale=1, seed=0):
+    rnd = random.Random("{}-{}".format(shape, seed))
+    os.makedirs(root, exist_ok=True)
+    SHAPES[shape](root, rnd, scale)
+    return root
+
+
+def projectStats(root):
+    files = 0
+    size = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            size += os.path.getsize(join(directory, name))
+    return files, size
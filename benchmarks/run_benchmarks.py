@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Times MicroFreezer.run and MicroFreezer.run_package over synthetic projects and compares the
+# results with a saved baseline.
+#
+# usage:
+#     python3 benchmarks/run_benchmarks.py [-o results.json] [-b baseline.json] [-t 0.2] [...]
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+REPO_DIR = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from aux_files.config import Config  # noqa: E402
+from microfreezer import MicroFreezer  # noqa: E402
+from generate_project import SHAPES, generateProject, projectStats  # noqa: E402
+
+MODES = ("frozen", "ota")
+
+
+def createConfig(directory, options):
+    config = {
+        "excludeList": [],
+        "directoriesKeptInFrozen": [],
+        "enableZlibCompression": True,
+        "targetESP32": True,
+        "targetPycom": False,
+        "minify": False,
+        "enableCache": False,
+    }
+    config.update(options)
+    config_file = join(directory, "config.json")
+    with open(config_file, "w") as f:
+        json.dump(config, f)
+    return Config(config_file)
+
+
+def runCase(shape, mode, workDir, options, repeat):
+    sourceDir = join(workDir, "source_" + shape)
+    if not os.path.isdir(sourceDir):
+        generateProject(shape, sourceDir, options["scale"])
+    inputFiles, inputBytes = projectStats(sourceDir)
+
+    config_obj = createConfig(workDir, options["config"])
+    best = None
+    for _ in range(repeat):
+        destDir = join(workDir, "output_{}_{}".format(shape, mode))
+        freezer = MicroFreezer(config_obj)
+        started = time.perf_counter()
+        if mode == "ota":
+            freezer.run_package(sourceDir, destDir)
+        else:
+            freezer.run(sourceDir, destDir)
+        seconds = time.perf_counter() - started
+        if best is None or seconds < best["seconds"]:
+            outputFiles, outputBytes = projectStats(destDir)
+            best = {
+                "name": "{}/{}".format(shape, mode),
+                "seconds": seconds,
+                "stages": dict(freezer.timings),
+                "inputFiles": inputFiles,
+                "inputBytes": inputBytes,
+                "outputFiles": outputFiles,
+                "outputBytes": outputBytes,
+                "throughputMBs": inputBytes / seconds / (1024 * 1024) if seconds > 0 else 0.0,
+            }
+    return best
+
+
+# returns the names of the cases that got slower than the baseline by more than threshold
+def compareWithBaseline(results, baseline, threshold):
+    baselineResults = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baselineResults.get(result["name"])
+        if previous is None:
+            continue
+        result["baselineSeconds"] = previous["seconds"]
+        result["change"] = result["seconds"] / previous["seconds"] - 1 if previous["seconds"] > 0 else 0.0
+        if result["change"] > threshold:
+            regressions.append(result["name"])
+    return regressions
+
+
+def printResults(results):
+    print("{:<22} {:>9} {:>10} {:>7} {:>11} {:>9}  {}".format("case", "seconds", "MB/s", "files", "output", "change", "stages"))
+    for result in results:
+        change = "{:+.1%}".format(result["change"]) if "change" in result else "-"
+        stages = ", ".join("{}: {:.3f}".format(name, seconds) for name, seconds in result["stages"].items())
+        print(
+            "{:<22} {:>9.3f} {:>10.2f} {:>7} {:>11} {:>9}  {}".format(
+                result["name"],
+                result["seconds"],
+                result["throughputMBs"],
+                result["inputFiles"],
+                result["outputBytes"],
+                change,
+                stages,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="microfreezer benchmarks")
+    parser.add_argument("-s", "--shapes", nargs="+", choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument("-m", "--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the size of the generated projects")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs of each case, the fastest one is kept")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--minify", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="measure warm builds with the build cache enabled")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("-b", "--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument("-w", "--work-dir", help="keep the generated projects and outputs in this folder")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    workDir = args.work_dir or tempfile.mkdtemp(prefix="microfreezer_bench_")
+    os.makedirs(workDir, exist_ok=True)
+    options = {
+        "scale": args.scale,
+        "config": {"jobs": args.jobs, "minify": args.minify, "enableCache": args.cache, "cacheDir": join(workDir, "cache")},
+    }
+
+    results = []
+    try:
+        for shape in args.shapes:
+            for mode in args.modes:
+                results.append(runCase(shape, mode, workDir, options, args.repeat))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(workDir)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compareWithBaseline(results, json.load(f), args.threshold)
+
+    printResults(results)
+
+    if args.output:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "options": options,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+    if regressions:
+        print("regressions beyond {:.0%}: {}".format(args.threshold, ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
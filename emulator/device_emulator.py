@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Runs the generated microwave.py and _apply_package.py under CPython, with shims of the micropython
+# modules backed by a sandboxed flash folder, and reports the peak Python heap (tracemalloc), the
+# bytes and files written to flash and the time spent on each file.
+#
+# usage:
+#     python3 emulator/device_emulator.py defrost <frozen-folder> [options]
+#     python3 emulator/device_emulator.py apply <package-folder> [options]
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+from os.path import abspath, dirname, join
+
+SHIMS_DIR = join(dirname(abspath(__file__)), "shims")
+
+# the shims import the active emulator from this module name
+sys.modules.setdefault("device_emulator", sys.modules[__name__])
+
+device = None
+
+
+# not an Exception, so that the device scripts do not catch it
+class DeviceReset(BaseException):
+    pass
+
+
+# file on the emulated flash with the micropython stream behaviour: bytes are accepted by files opened
+# in text mode and readinto takes an optional byte count
+class FlashFile:
+    def __init__(self, emulator, path, host_path, mode):
+        self.emulator = emulator
+        self.path = path
+        self.writing = "w" in mode or "a" in mode
+        self.file = open(host_path, mode.replace("t", "").replace("b", "") + "b")
+        self.started = time.perf_counter()
+        self.written = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.written += len(data)
+        return self.file.write(data)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def readinto(self, buf, size=None):
+        if size is None:
+            return self.file.readinto(buf)
+        return self.file.readinto(memoryview(buf)[:size])
+
+    def seek(self, offset, whence=0):
+        return self.file.seek(offset, whence)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            if self.writing:
+                self.emulator.recordWrite(self.path, self.written, time.perf_counter() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DeviceEmulator:
+    def __init__(self, flash_dir=None, flash_root="/", verbose=False):
+        self.flash_dir = flash_dir if flash_dir else tempfile.mkdtemp(prefix="microfreezer_flash_")
+        self.flash_root = flash_root
+        self.cwd = flash_root
+        self.verbose = verbose
+        os.makedirs(self.hostPath(flash_root), exist_ok=True)
+        self.resetStats()
+
+    def resetStats(self):
+        self.bytes_written = 0
+        self.files = []
+        self.output = []
+
+    def devicePath(self, path):
+        if not path.startswith("/"):
+            path = self.cwd.rstrip("/") + "/" + path
+        return os.path.normpath(path).replace(os.sep, "/")
+
+    def hostPath(self, path):
+        return join(self.flash_dir, self.devicePath(path).lstrip("/"))
+
+    def chdir(self, path):
+        self.cwd = self.devicePath(path)
+
+    def open(self, path, mode="r", *args, **kwargs):
+        if "w" in mode or "a" in mode or "b" in mode:
+            return FlashFile(self, self.devicePath(path), self.hostPath(path), mode)
+        return open(self.hostPath(path), mode, *args, **kwargs)
+
+    def recordWrite(self, path, size, seconds):
+        self.bytes_written += size
+        self.files.append({"path": path, "bytes": size, "seconds": seconds})
+
+    def print(self, *args, **kwargs):
+        line = " ".join(str(arg) for arg in args)
+        self.output.append(line)
+        if self.verbose:
+            print(line)
+
+    def printException(self, e):
+        self.output.append("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        if self.verbose:
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    def memFree(self):
+        return max(0, 1024 * 1024 - tracemalloc.get_traced_memory()[0])
+
+    # runs function with the shims importable and the micropython only functions in place
+    def execute(self, function, module_paths=()):
+        global device
+
+        self.resetStats()
+        saved_path = list(sys.path)
+        saved_modules = set(sys.modules)
+        saved_print_exception = getattr(sys, "print_exception", None)
+        saved_mem_free = getattr(gc, "mem_free", None)
+        sys.path[:0] = [SHIMS_DIR] + list(module_paths)
+        sys.print_exception = self.printException
+        gc.mem_free = self.memFree
+        device = self
+        reset = False
+        error = None
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            function()
+        except DeviceReset:
+            reset = True
+        except Exception as e:
+            error = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+        elapsed = time.perf_counter() - started
+        _, peak_heap = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        device = None
+        sys.path[:] = saved_path
+        for name in set(sys.modules) - saved_modules:
+            sys.modules.pop(name)
+        if saved_print_exception is None:
+            del sys.print_exception
+        else:
+            sys.print_exception = saved_print_exception
+        if saved_mem_free is None:
+            del gc.mem_free
+        else:
+            gc.mem_free = saved_mem_free
+
+        return {
+            "peakHeap": peak_heap,
+            "bytesWritten": self.bytes_written,
+            "filesWritten": len(self.files),
+            "elapsed": elapsed,
+            "reset": reset,
+            "error": error,
+            "files": self.files,
+        }
+
+    # runs microwave.defrost from the folder that contains the generated _todefrost folder
+    def defrost(self, frozen_dir):
+        def run():
+            from _todefrost import microwave
+
+            microwave.open = self.open
+            microwave.print = self.print
+            microwave.defrost()
+
+        return self.execute(run, [abspath(frozen_dir)])
+
+    # copies the package and _apply_package.py of an OTA build to the flash root and runs it
+    def applyPackage(self, package_dir):
+        for f in os.listdir(package_dir):
+            if f.endswith(".tar") or f.endswith(".tar.gz") or f == "_apply_package.py":
+                shutil.copyfile(join(package_dir, f), self.hostPath(self.flash_root + "/" + f))
+        return self.runApplyScript()
+
+    # runs the _apply_package.py of the flash root
+    def runApplyScript(self):
+        def run():
+            import runpy
+
+            self.cwd = self.flash_root
+            runpy.run_path(
+                self.hostPath(self.flash_root + "/_apply_package.py"),
+                init_globals={"open": self.open, "print": self.print},
+                run_name="__main__",
+            )
+
+        return self.execute(run)
+
+
+# returns the list of exceeded budgets of a report
+def checkBudgets(report, max_heap=None, max_bytes_written=None):
+    failures = []
+    if report["error"]:
+        failures.append("device script failed:\n" + report["error"])
+    if max_heap is not None and report["peakHeap"] > max_heap:
+        failures.append("peak heap {} bytes exceeds {} bytes".format(report["peakHeap"], max_heap))
+    if max_bytes_written is not None and report["bytesWritten"] > max_bytes_written:
+        failures.append("flash writes {} bytes exceed {} bytes".format(report["bytesWritten"], max_bytes_written))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run microfreezer device scripts under CPython")
+    parser.add_argument("command", choices=["defrost", "apply"])
+    parser.add_argument("path", help="the frozen folder containing _todefrost, or the OTA package folder")
+    parser.add_argument("--flash", help="the folder emulating the device filesystem, kept between runs")
+    parser.add_argument("--flash-root", default="/", help="the root folder of the user space, /flash on pycom devices")
+    parser.add_argument("--max-heap", type=int, help="fail if the peak Python heap exceeds this many bytes")
+    parser.add_argument("--max-flash-writes", type=int, help="fail if more bytes than this are written to flash")
+    parser.add_argument("--json", help="write the report as JSON to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the output of the device script")
+    args = parser.parse_args()
+
+    emulator = DeviceEmulator(args.flash, args.flash_root, args.verbose)
+    if args.command == "defrost":
+        report = emulator.defrost(args.path)
+    else:
+        report = emulator.applyPackage(args.path)
+
+    slowest = sorted(report["files"], key=lambda f: f["seconds"], reverse=True)[:5]
+    print("peak heap:      {} bytes".format(report["peakHeap"]))
+    print("flash writes:   {} bytes in {} files".format(report["bytesWritten"], report["filesWritten"]))
+    print("elapsed:        {:.3f} s".format(report["elapsed"]))
+    for f in slowest:
+        print("    {:.4f} s  {:>9} bytes  {}".format(f["seconds"], f["bytes"], f["path"]))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+
+    failures = checkBudgets(report, args.max_heap, args.max_flash_writes)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# minimal uctypes shim, covering the UINT8 arrays used by the tar header of _apply_package.py
+ARRAY = 1 << 30
+UINT8 = 1 << 24
+LITTLE_ENDIAN = 0
+BIG_ENDIAN = 1
+
+
+def addressof(buf):
+    return buf
+
+
+class struct:
+    def __init__(self, buf, descriptor, layout=LITTLE_ENDIAN):
+        for name, (offset, field) in descriptor.items():
+            offset &= ~ARRAY
+            length = field & 0xFFFF
+            setattr(self, name, bytes(buf[offset : offset + length]))
@@ -0,0 +1,56 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# uos shim backed by the sandboxed flash of the device emulator
+import os
+
+from device_emulator import device
+
+
+def listdir(path="."):
+    return os.listdir(device.hostPath(path))
+
+
+def mkdir(path):
+    os.mkdir(device.hostPath(path))
+
+
+def remove(path):
+    os.remove(device.hostPath(path))
+
+
+def rmdir(path):
+    os.rmdir(device.hostPath(path))
+
+
+def rename(old_path, new_path):
+    os.rename(device.hostPath(old_path), device.hostPath(new_path))
+
+
+def stat(path):
+    return tuple(os.stat(device.hostPath(path)))
+
+
+def getcwd():
+    return device.cwd
+
+
+def chdir(path):
+    device.chdir(path)
@@ -0,0 +1,62 @@
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# uzlib shim, wbits follows micropython: 0 or positive for a zlib header, negative for raw deflate
+import zlib
+
+
+def zlibWbits(wbits):
+    if wbits < 0:
+        return wbits
+    if wbits >= 16:
+        return 16 + 15
+    return 15
+
+
+def decompress(data, wbits=0):
+    return zlib.decompress(bytes(data), zlibWbits(wbits))
+
+
+class DecompIO:
+    def __init__(self, stream, wbits=0, read_size=128):
+        self.stream = stream
+        self.decompressor = zlib.decompressobj(zlibWbits(wbits))
+        self.read_size = read_size
+        self.buffer = b""
+
+    def fill(self, size):
+        while len(self.buffer) < size and not self.decompressor.eof:
+            data = self.decompressor.unconsumed_tail or self.stream.read(self.read_size)
+            if not data:
+                break
+            self.buffer += self.decompressor.decompress(data, size - len(self.buffer))
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 1 << 30
+        self.fill(size)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readinto(self, buf, size=None):
+        size = len(buf) if size is None else min(size, len(buf))
+        data = self.read(size)
+        buf[: len(data)] = data
+        return len(data)
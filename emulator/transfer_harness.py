@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Delivers the chunks of a chunked OTA package (otaChunkSize) to an emulated flash the way an unreliable
+# downloader would, and checks that _apply_package.py applies the package only once every chunk is intact:
+#
+#     complete:        all the chunks at once
+#     truncated:       the first half of the chunks, the last of them cut short, then the rest
+#     corrupted:       all the chunks with a flipped byte in one of them, then that chunk again
+#     truncatedHeader: all the chunks with chunks.json cut short, then chunks.json again
+#
+# The package must be a full one, as every scenario starts from an empty flash.
+#
+# usage:
+#     python3 emulator/transfer_harness.py <package-folder> [options]
+
+import argparse
+import binascii
+import hashlib
+import json
+import os
+import shutil
+import sys
+from os.path import join
+
+from device_emulator import DeviceEmulator
+
+CHUNKS_SUFFIX = ".chunks"
+CHUNKS_HEADER = "chunks.json"
+
+
+# the header of chunks.json, whose last line is the CRC32 of the JSON before it
+def readHeader(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    end = data.rfind(b"\n", 0, len(data) - 1)
+    if binascii.crc32(data[:end]) != int(data[end + 1:], 16):
+        raise ValueError("{}: CRC32 mismatch".format(path))
+    return json.loads(data[:end])
+
+
+def findChunks(package_dir):
+    for f in os.listdir(package_dir):
+        if f.endswith(CHUNKS_SUFFIX):
+            return join(package_dir, f)
+    raise FileNotFoundError("no {} folder in {}, build the package with otaChunkSize".format(CHUNKS_SUFFIX, package_dir))
+
+
+class TransferHarness:
+    def __init__(self, package_dir, flash_root="/", verbose=False):
+        self.package_dir = package_dir
+        self.flash_root = flash_root
+        self.verbose = verbose
+        self.chunks_dir = findChunks(package_dir)
+        self.header = readHeader(join(self.chunks_dir, CHUNKS_HEADER))
+        with open(join(package_dir, "package_manifest.json")) as f:
+            self.manifest = json.load(f)
+
+    # a fresh flash with _apply_package.py and the header of the chunks, as the downloader fetches it first
+    def newDevice(self, header=None):
+        emulator = DeviceEmulator(flash_root=self.flash_root, verbose=self.verbose)
+        shutil.copyfile(join(self.package_dir, "_apply_package.py"), emulator.hostPath(self.flash_root + "/_apply_package.py"))
+        os.makedirs(self.deviceChunks(emulator))
+        self.deliverHeader(emulator, header)
+        return emulator
+
+    def deliverHeader(self, emulator, data=None):
+        with open(join(self.chunks_dir, CHUNKS_HEADER), "rb") as f:
+            header = f.read()
+        with open(join(self.deviceChunks(emulator), CHUNKS_HEADER), "wb") as f:
+            f.write(header if data is None else data)
+
+    def deviceChunks(self, emulator):
+        return emulator.hostPath(self.flash_root + "/" + os.path.basename(self.chunks_dir))
+
+    def chunk(self, index):
+        with open(join(self.chunks_dir, str(index)), "rb") as f:
+            return f.read()
+
+    def deliver(self, emulator, index, data=None):
+        with open(join(self.deviceChunks(emulator), str(index)), "wb") as f:
+            f.write(self.chunk(index) if data is None else data)
+
+    # returns the files of the manifest missing from the flash or differing from it
+    def mismatches(self, emulator):
+        failed = []
+        for entry in self.manifest["files"]:
+            host_path = emulator.hostPath(self.flash_root + "/" + entry["path"])
+            if not os.path.isfile(host_path):
+                failed.append(entry["path"])
+                continue
+            with open(host_path, "rb") as f:
+                if hashlib.md5(f.read()).hexdigest() != entry["hash"]:
+                    failed.append(entry["path"])
+        return failed
+
+    def expectApplied(self, emulator, report):
+        failures = []
+        if report["error"]:
+            failures.append("apply failed:\n" + report["error"])
+        if not report["reset"]:
+            failures.append("the device was not reset")
+        failures += ["{} differs from the package".format(path) for path in self.mismatches(emulator)]
+        if os.path.exists(self.deviceChunks(emulator)):
+            failures.append("the chunks were not removed")
+        return failures
+
+    def expectWaiting(self, report, description):
+        failures = []
+        if report["error"]:
+            failures.append("apply failed:\n" + report["error"])
+        if report["reset"]:
+            failures.append("the package was applied with " + description)
+        return failures
+
+    def complete(self):
+        emulator = self.newDevice()
+        for index in range(len(self.header["chunks"])):
+            self.deliver(emulator, index)
+        return self.expectApplied(emulator, emulator.runApplyScript())
+
+    def truncated(self):
+        emulator = self.newDevice()
+        count = len(self.header["chunks"])
+        half = max(1, count // 2)
+        for index in range(half - 1):
+            self.deliver(emulator, index)
+        self.deliver(emulator, half - 1, self.chunk(half - 1)[:-1])
+
+        failures = self.expectWaiting(emulator.runApplyScript(), "a truncated chunk")
+        if os.path.exists(join(self.deviceChunks(emulator), str(half - 1))):
+            failures.append("the truncated chunk {} was kept".format(half - 1))
+        for index in range(half - 1, count):
+            self.deliver(emulator, index)
+        return failures + self.expectApplied(emulator, emulator.runApplyScript())
+
+    def corrupted(self):
+        emulator = self.newDevice()
+        count = len(self.header["chunks"])
+        bad = count // 2
+        data = bytearray(self.chunk(bad))
+        data[len(data) // 2] ^= 0xFF
+        for index in range(count):
+            self.deliver(emulator, index, bytes(data) if index == bad else None)
+
+        failures = self.expectWaiting(emulator.runApplyScript(), "a corrupted chunk")
+        if os.path.exists(join(self.deviceChunks(emulator), str(bad))):
+            failures.append("the corrupted chunk {} was kept".format(bad))
+        self.deliver(emulator, bad)
+        return failures + self.expectApplied(emulator, emulator.runApplyScript())
+
+    def truncatedHeader(self):
+        with open(join(self.chunks_dir, CHUNKS_HEADER), "rb") as f:
+            header = f.read()
+        emulator = self.newDevice(header[: len(header) // 2])
+        for index in range(len(self.header["chunks"])):
+            self.deliver(emulator, index)
+
+        failures = self.expectWaiting(emulator.runApplyScript(), "a truncated chunks.json")
+        if os.path.exists(join(self.deviceChunks(emulator), CHUNKS_HEADER)):
+            failures.append("the truncated chunks.json was kept")
+        if not os.path.exists(join(self.deviceChunks(emulator), "0")):
+            failures.append("the chunks were removed")
+        self.deliverHeader(emulator)
+        return failures + self.expectApplied(emulator, emulator.runApplyScript())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check the resumable transfer of a chunked OTA package")
+    parser.add_argument("path", help="the OTA package folder, built with otaChunkSize")
+    parser.add_argument("--flash-root", default="/", help="the root folder of the user space, /flash on pycom devices")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the output of the device script")
+    args = parser.parse_args()
+
+    harness = TransferHarness(args.path, args.flash_root, args.verbose)
+    header = harness.header
+    print("{}: {} chunks of {} bytes".format(header["package"], len(header["chunks"]), header["chunkSize"]))
+    failed = False
+    for scenario in (harness.complete, harness.truncated, harness.corrupted, harness.truncatedHeader):
+        failures = scenario()
+        print("{}: {}".format("FAIL" if failures else "PASS", scenario.__name__))
+        for failure in failures:
+            print("    " + failure)
+        failed = failed or bool(failures)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,15 +27,26 @@ from shutil import copyfile, rmtree
 import binascii
 import traceback
 import hashlib
+import json
+import time
 from functools import partial
-from aux_files.config import Config
+from aux_files.config import Config, TargetConfig
+from aux_files.cache import BuildCache
+from aux_files.matcher import ExcludeList, PathMatcher
+from aux_files.pipeline import STAGES, loadPlugins, pluginVersions, runPipeline, stageNames
+from aux_files.report import SizeReport
+import aux_files.profiler as profiler
 import getopt, sys
 
 
+# the templates of the generated device scripts, next to this file
+AUX_FILES_DIR = join(os.path.dirname(os.path.abspath(__file__)), "aux_files")
+
+
 def mkdir(dirPath):
     try:
         logging.debug("Making directory: {}".format(dirPath))
-        os.mkdir(dirPath)
+        os.makedirs(dirPath)
     except Exception as e:
         logging.debug("directory {} already exists?".format(dirPath))
 
@@ -49,8 +60,7 @@ def readFromFile(source, open_binary=False):
         return contents
     except Exception as e:
         logging.debug("file [{}] read failed.".format(source))
-        traceback.print_exc()
-        return ""
+        raise
 
 
 def writeToFile(destination, content, open_binary=False):
@@ -62,8 +72,29 @@ def writeToFile(destination, content, open_binary=False):
         return True
     except Exception as e:
         logging.debug("file [{}] write failed.".format(destination))
-        traceback.print_exc()
-    return False
+        raise
+
+
+# writes content only when it differs from the current contents of destination, so that unchanged
+# outputs keep their modification time. Returns True when the file was written
+def writeToFileIfChanged(destination, content, open_binary=False):
+    data = content if open_binary else content.encode("utf-8")
+    try:
+        with open(destination, "rb") as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    return writeToFile(destination, data, True)
+
+
+def sameContents(path, otherPath):
+    import filecmp
+
+    try:
+        return filecmp.cmp(path, otherPath, shallow=False)
+    except OSError:
+        return False
 
 
 def removeFile(directoryPath):
@@ -74,16 +105,37 @@ def removeFile(directoryPath):
         logging.error("remove file {} failed".format(directoryPath))
 
 
-# Create a single md5 sum for all files included in folders and subfolders of path
-def md5folder(directoryPath, blocksize=65536):
+# worker function, returns the md5 hash of the contents of a file
+def md5file(path, blocksize=65536):
     hash = hashlib.md5()
-    logging.info("[md5sum]: Starting calculation of md5sum of folder: " + directoryPath)
-    for directory, _, files in os.walk(directoryPath):
-        for f in files:
-            path = join(directory, f)
-            with open(path, "rb") as tmpF:
-                for block in iter(partial(tmpF.read, blocksize), b""):
-                    hash.update(block)
+    with open(path, "rb") as f:
+        for block in iter(partial(f.read, blocksize), b""):
+            hash.update(block)
+    return hash.hexdigest()
+
+
+# Combines the per-file hashes of the manifest entries into a single md5 sum of the package. Every
+# directory hashes the sorted names and hashes of its children, so the result depends only on the
+# paths and the contents of the files and not on the order they were listed in
+def merkleRoot(entries):
+    tree = {}
+    for entry in entries:
+        parts = entry["path"].split("/")
+        node = tree
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = entry["hash"]
+    return md5tree(tree)
+
+
+def md5tree(node):
+    hash = hashlib.md5()
+    for name in sorted(node):
+        child = node[name]
+        if isinstance(child, dict):
+            hash.update("d {} {}\n".format(name, md5tree(child)).encode("utf-8"))
+        else:
+            hash.update("f {} {}\n".format(name, child).encode("utf-8"))
     return hash.hexdigest()
 
 
@@ -96,30 +148,363 @@ def removeContents(directoryBaseDir, directoryContents):
             rmtree(path)
 
 
-def isAnySubstringInString(substring_list, string):
-    for substr in substring_list:
-        if substr in string:
-            return True
-    return False
+PACKAGE_MANIFEST_FILE = "package_manifest.json"
+PACKAGE_DELTA_FILE = "package_delta.json"
+PACKAGE_CHUNKS_SUFFIX = ".chunks"
+PACKAGE_CHUNKS_HEADER = "chunks.json"
+VARIANT_STORE_DIR = "objects"
+VARIANT_REPORT_FILE = "variants_report.json"
+
+
+def md5hex(data):
+    return hashlib.md5(data).hexdigest()
+
+
+# runs the pipeline stages of a file, returning its contents as they will be shipped to the device
+def prepareFileContents(sourceFile, destFile, stages, plugins=()):
+    file = runPipeline(sourceFile, destFile, stages, plugins)
+    contents = file["payload"]
+    return {
+        "destFile": file["destFile"],
+        "precompiled": file["precompiled"],
+        "hash": profiler.call("md5", md5hex, contents, bytesIn=len(contents)),
+        "payload": contents,
+    }
+
+
+def mpyName(path):
+    return path[: -len(".py")] + ".mpy"
+
+
+# tries every combination of compression level and window size and returns the smallest result as
+# (codec, level, windowBits, compressed data). Falls back to "store" when compression does not save
+# at least minSaving of the size, as is the case with already compressed files
+def selectCodec(data, levels, windowBits, minSaving=0.0):
+    best = None
+    for level in levels:
+        for wbits in windowBits:
+            compressed = profiler.call("zlib", compressWith, data, level, wbits, bytesIn=len(data))
+            if best is None or len(compressed) < len(best[3]):
+                best = ("zlib", level, wbits, compressed)
+
+    if best is None or len(best[3]) >= len(data) or len(best[3]) > len(data) * (1 - minSaving):
+        return ("store", None, None, data)
+    return best
+
+
+def compressWith(data, level, wbits):
+    import zlib
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+# worker functions are kept at module level so that they can be sent to the process pool.
+# Returns the compressed payload of the file along with its hash and its size at each step,
+# the encoding and the layout of the modules are applied afterwards
+def convertFileToBase64(
+    sourceFile,
+    destFile,
+    stages,
+    plugins,
+    enableZlibCompression,
+    chunkSize=0,
+    levels=(4,),
+    windowBits=(15,),
+    minSaving=0.0,
+    keepContents=False,
+):
+    prepared = prepareFileContents(sourceFile, destFile, stages, plugins)
+    result = compressFileContents(sourceFile, prepared, enableZlibCompression, chunkSize, levels, windowBits, minSaving)
+    # the contents before compression can be reused by the other targets of a multi-target build
+    if keepContents:
+        result["contents"] = prepared
+    return result
+
+
+# compresses the contents of a file prepared by prepareFileContents
+def compressFileContents(
+    sourceFile, prepared, enableZlibCompression, chunkSize=0, levels=(4,), windowBits=(15,), minSaving=0.0
+):
+    sourceSize = os.path.getsize(sourceFile)
+    logging.debug("  [C]: " + str(sourceFile))
+    bytes = prepared["payload"]
+
+    # hash of the file as it will be written on the device, used to skip unchanged files while defrosting
+    # and as the leaf of the package md5sum
+    fileHash = prepared["hash"]
+    fileSize = len(bytes)
+
+    # files bigger than chunkSize are split in chunks that are compressed independently,
+    # so that the device never needs more than a chunk in RAM
+    codec, level, wbits, compressed = ("store", None, None, bytes)
+    if enableZlibCompression:
+        codec, level, wbits, compressed = selectCodec(bytes, levels, windowBits, minSaving)
+
+    if chunkSize and fileSize > chunkSize:
+        chunks = [bytes[i : i + chunkSize] for i in range(0, fileSize, chunkSize)]
+        if codec == "zlib":
+            chunks = [compressWith(chunk, level, wbits) for chunk in chunks]
+    else:
+        chunks = [compressed]
+    bytes = b"".join(chunks)
+
+    return {
+        "hash": fileHash,
+        "destFile": prepared["destFile"],
+        "precompiled": prepared["precompiled"],
+        "codec": codec,
+        "level": level,
+        "windowBits": wbits,
+        "sourceSize": sourceSize,
+        "fileSize": fileSize,
+        "payloadSize": len(bytes),
+        "chunks": [len(chunk) for chunk in chunks] if len(chunks) > 1 else None,
+        "payload": bytes,
+    }
+
+
+# the contents of a file that was compressed on its own, to be compressed again along with other files
+def decompressPayload(result):
+    import zlib
+
+    return zlib.decompress(result["payload"], result["windowBits"])
+
+
+def splitChunks(result):
+    chunks = []
+    offset = 0
+    for size in result["chunks"]:
+        chunks.append(result["payload"][offset : offset + size])
+        offset += size
+    return chunks
+
+
+# files whose contents did not change are not written again. Returns the contents produced by the
+# pipeline stages, so that they can be stored in the build cache, and whether the destination was written
+def copyFile(sourceFile, destFile, relativePath, stages, plugins=()):
+    if stages:
+        logging.debug("file [S]: " + str(sourceFile))
+        contents = runPipeline(sourceFile, relativePath, stages, plugins)["payload"]
+        return contents, writeToFileIfChanged(destFile, contents, True)
+    else:
+        logging.debug("file: " + str(sourceFile))
+        if sameContents(sourceFile, destFile):
+            return None, False
+        copyfile(sourceFile, destFile)
+        return None, True
+
+
+# file object that compresses everything written to it into the package format expected by
+# _apply_package.py: 8 gzip-like header bytes + zlib stream + crc32 of the zlib stream (4 bytes)
+class CompressedPackageWriter:
+    def __init__(self, out_file, level=4, wbits=15):
+        import zlib
+
+        self.out_file = out_file
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        self.crc = 0
+        self.out_file.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00")
+
+    def writeCompressed(self, data):
+        import zlib
+
+        if data:
+            self.crc = zlib.crc32(data, self.crc)
+            self.out_file.write(data)
+
+    def write(self, data):
+        self.writeCompressed(profiler.call("zlib", self.compressor.compress, data, bytesIn=len(data)))
+        return len(data)
+
+    def finish(self):
+        self.writeCompressed(self.compressor.flush())
+        self.out_file.write((self.crc & 0xFFFFFFFF).to_bytes(length=4, byteorder="big"))
+
+
+# reads from a file object while updating the given hash objects
+class HashingReader:
+    def __init__(self, in_file, hashes):
+        self.in_file = in_file
+        self.hashes = hashes
+
+    def read(self, size=-1):
+        data = self.in_file.read(size)
+        for hash in self.hashes:
+            hash.update(data)
+        return data
+
+
+# The outcome of MicroFreezer.build: the files that reach the device with their sizes and hashes (the
+# entries of the package manifest), the generated outputs with their sizes, the timings of the build
+# stages, the hits and misses of the build cache and the errors that stopped it. Multi-target builds have
+# a BuildResult per target in targets, and variant builds one per variant in variants, along with the
+# dedupRatio of the store shared by the variants. Frozen builds with solid compression report its savings in solid.
+# report is the SizeReport of frozen and OTA builds, as a dict, and profile the stages and slowest files of the
+# profiled builds
+class BuildResult:
+    def __init__(self, sourceDir, destDir):
+        self.sourceDir = sourceDir
+        self.destDir = destDir
+        self.md5sum = None
+        self.files = []
+        self.outputs = {}
+        self.package = None
+        self.timings = {}
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.errors = []
+        self.targets = {}
+        self.variants = {}
+        self.dedupRatio = None
+        self.solid = None
+        self.report = None
+        self.profile = None
+
+    @property
+    def ok(self):
+        results = list(self.targets.values()) + list(self.variants.values())
+        return not self.errors and all(result.ok for result in results)
+
+    def asDict(self):
+        return {
+            "sourceDir": self.sourceDir,
+            "destDir": self.destDir,
+            "ok": self.ok,
+            "md5sum": self.md5sum,
+            "files": self.files,
+            "outputs": self.outputs,
+            "package": self.package,
+            "timings": self.timings,
+            "cacheHits": self.cacheHits,
+            "cacheMisses": self.cacheMisses,
+            "errors": self.errors,
+            "targets": {name: target.asDict() for name, target in self.targets.items()},
+            "variants": {name: variant.asDict() for name, variant in self.variants.items()},
+            "dedupRatio": self.dedupRatio,
+            "solid": self.solid,
+            "report": self.report,
+            "profile": self.profile,
+        }
 
 
 class MicroFreezer:
     def __init__(self, config_obj=None):
         self.config = config_obj if config_obj is not None else Config()
         self.excludeList = self.config.get("excludeList", [])
+        self.useGitignore = self.config.get("useGitignore", False)
+        self.sourceMatcher = PathMatcher(self.excludeList)
         self.directoriesKeptInFrozen = self.config.get("directoriesKeptInFrozen", [])
         self.enableZlibCompression = self.config.get("enableZlibCompression", True)
         self.minify = self.config.get("minify", False)
-        self.minifyExcludeFolderList = self.config.get("minifyExcludeFolderList", [])
+        self.minifyExcludeFolderList = ExcludeList(self.config.get("minifyExcludeFolderList", []))
         self.targetESP32 = self.config.get("targetESP32", False)
         self.targetPycom = self.config.get("targetPycom", True)
         self.flashRootFolder = "/flash/" if self.targetPycom else "/"
         self.flashRootFolder = os.path.normpath(self.flashRootFolder)
+        self.jobs = self.config.get("jobs", 1)
+        self.executor = None
+        self.sharedPool = None
+        self.enableCache = self.config.get("enableCache", True)
+        self.cacheDir = self.config.get("cacheDir", None)
+        self.cacheMaxSize = self.config.get("cacheMaxSize", 256 * 1024 * 1024)
+        self.cache = None
+        self.memoryCache = None
+        self.timings = {}
+        self.encoding = self.config.get("encoding", "base64")
+        if self.encoding not in ("base64", "bytes"):
+            logging.warning("unknown encoding: {}, using base64".format(self.encoding))
+            self.encoding = "base64"
+        self.layout = self.config.get("layout", "module")
+        if self.layout not in ("module", "bundle"):
+            logging.warning("unknown layout: {}, using module".format(self.layout))
+            self.layout = "module"
+        self.bundleMaxSize = self.config.get("bundleMaxSize", 16384)
+        self.chunkSize = self.config.get("chunkSize", 0)
+        self.compressionLevels = tuple(self.config.get("compressionLevels", [4]))
+        self.compressionMinSaving = self.config.get("compressionMinSaving", 0.0)
+        self.deviceRamBudget = self.config.get("deviceRamBudget", None)
+        self.solidBlockSize = self.config.get("solidBlockSize", 0)
+        if self.solidBlockSize and self.layout != "bundle":
+            logging.info("[solid]: solid compression uses the bundle layout")
+            self.layout = "bundle"
+        # the device holds a whole decompressed block in RAM
+        if self.solidBlockSize and self.deviceRamBudget and self.solidBlockSize > self.deviceRamBudget:
+            logging.info("[solid]: block size limited to {} bytes by the device RAM budget".format(self.deviceRamBudget))
+            self.solidBlockSize = self.deviceRamBudget
+        self.solidStats = None
+        self.solidShares = {}
+        self.compressionWindowBits = self.windowBitsWithinBudget(self.config.get("compressionWindowBits", [15]))
+        self.precompile = self.config.get("precompile", False)
+        self.mpyCrossPath = self.config.get("mpyCrossPath", "mpy-cross")
+        self.mpyCrossArgs = tuple(self.config.get("mpyCrossArgs", []))
+        self.precompileExcludeList = ExcludeList(self.config.get("precompileExcludeList", []))
+        self.mpyCrossVersion = None
+        self.pipeline = self.config.get("pipeline", [])
+        self.pipelinePlugins = tuple(self.config.get("pipelinePlugins", []))
+        loadPlugins(self.pipelinePlugins)
+        self.pipelineRules = []
+        for rule in self.pipeline:
+            stages = [self.stageSpec(stage) for stage in rule["stages"]]
+            for name, _ in stages:
+                if name not in STAGES:
+                    raise ValueError("unknown pipeline stage: {}".format(name))
+            patterns = rule["match"] if isinstance(rule["match"], list) else [rule["match"]]
+            self.pipelineRules.append((PathMatcher(patterns), stages))
+        self.otaStreamingExtract = self.config.get("otaStreamingExtract", True)
+        self.otaCopyBufferSize = self.config.get("otaCopyBufferSize", 512)
+        self.otaChunkSize = self.config.get("otaChunkSize", 0)
+        self.frozenBudget = self.config.get("frozenBudget", None)
+        self.otaPackageBudget = self.config.get("otaPackageBudget", None)
+        self.sizeReport = None
+        self.incremental = False
+        self.outputs = set()
+        self.rewrittenOutputs = 0
+        self.moduleNumbers = {}
+        self.targets = self.config.get("targets", [])
+        self.targetFreezers = {}
+        self.variants = self.config.get("variants", [])
+        self.variantFreezers = {}
+        self.fleetReport = None
+        self.overlayDir = None
+        self.resultStore = None
+        self.manifest = None
+        self.packageFile = None
         logging.info("Selected flash root folder: " + self.flashRootFolder)
 
+    # the window size sets the memory the decompressor needs on the device, so the window sizes
+    # that do not fit in deviceRamBudget are dropped
+    def windowBitsWithinBudget(self, windowBits):
+        windowBits = [wbits for wbits in windowBits if 9 <= wbits <= 15]
+        if self.deviceRamBudget:
+            maxWindowBits = max(9, min(15, int(self.deviceRamBudget).bit_length() - 1))
+            allowed = [wbits for wbits in windowBits if wbits <= maxWindowBits]
+            if len(allowed) < len(windowBits):
+                logging.info("[codecs]: window sizes limited to {} bits by the device RAM budget".format(maxWindowBits))
+            windowBits = allowed if allowed else [maxWindowBits]
+        return tuple(windowBits) if windowBits else (15,)
+
+    # runs a stage of the build and adds its wall time to self.timings
+    def timeStage(self, name, function, *args):
+        started = time.perf_counter()
+        try:
+            return profiler.call(name, function, *args)
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
     def run(self, sourceDir, destDir):
+        self.timings = {}
+        self.solidStats = None
+        self.solidShares = {}
+        self.sizeReport = SizeReport(self.frozenBudget, self.otaPackageBudget)
+        self.manifest = None
+        self.packageFile = None
         self.convertedFileNumber = 0
+        self.filePlan = []
+        self.copyPlan = []
+        self.manifestEntries = []
         self.baseSourceDir = sourceDir
+        self.loadSourceMatcher(sourceDir)
         self.baseDestDir = destDir
         if self.targetESP32:
             self.baseDestDirCustom = destDir
@@ -129,210 +514,1216 @@ class MicroFreezer:
             self.baseDestDirBase = join(destDir, "Base")
         self.defrostFolderPath = join(self.baseDestDirCustom, "_todefrost")
 
-        logging.info("deleting old files from {}".format(self.baseDestDir))
-        mkdir(self.baseDestDir)
-        removeContents(self.baseDestDir, listdir(self.baseDestDir))
+        self.prepareDestination()
         mkdir(self.baseDestDirCustom)
         mkdir(self.baseDestDirBase)
         mkdir(self.defrostFolderPath)
 
         logging.info("Copying new files to {}".format(self.baseDestDir))
-        self.processFiles()
+        self.detectPrecompiler()
+        self.openCache()
+        try:
+            self.timeStage("walk", self.processFiles)
+            self.timeStage("copy", self.copyFiles)
+            self.timeStage("convert", self.convertFiles)
+        finally:
+            self.shutdownExecutor()
+            self.closeCache()
         logging.info("Finalizing...")
-        self.finalize()
+        self.timeStage("finalize", self.finalize)
+        self.removeStaleOutputs((self.baseDestDirBase, self.baseDestDirCustom, self.defrostFolderPath))
         logging.info("Operation completed successfully.")
 
-    def run_package(self, sourceDir, destDir):
+    # when baseManifestFile is given, the package contains only the differences from that build
+    def run_package(self, sourceDir, destDir, baseManifestFile=None):
+        self.timings = {}
+        self.sizeReport = SizeReport(self.frozenBudget, self.otaPackageBudget)
+        self.manifest = None
+        self.packageFile = None
+        self.baseManifest = None
+        if baseManifestFile is not None:
+            self.baseManifest = json.loads(readFromFile(baseManifestFile))
+            logging.info("creating delta package against base: {}".format(self.baseManifest["md5sum"]))
+        self.packagePlan = []
         self.baseSourceDir = sourceDir
+        self.loadSourceMatcher(sourceDir)
         self.baseDestDir = destDir
 
-        logging.info("deleting old files from {}".format(self.baseDestDir))
-        mkdir(self.baseDestDir)
-        removeContents(self.baseDestDir, listdir(self.baseDestDir))
-
-        logging.info("Copying new files to {}".format(self.baseDestDir))
-        self.copyRecursive(self.baseSourceDir, self.baseDestDir, True)
+        self.prepareDestination()
 
+        logging.info("Packaging files to {}".format(self.baseDestDir))
+        self.detectPrecompiler()
+        self.openCache()
+        try:
+            self.timeStage("walk", self.planPackage, self.baseSourceDir)
+            manifest = self.timeStage("package", self.createTarFile)
+            self.manifest = manifest
+        finally:
+            self.shutdownExecutor()
+            self.closeCache()
+
+        if self.otaChunkSize > 0:
+            self.timeStage("split", self.splitPackage)
         logging.info("Finalizing...")
-        self.finalize_package()
+        self.timeStage("finalize", self.finalize_package, manifest)
+        self.removeStaleOutputs()
         logging.info("Operation completed successfully.")
 
-    # https://www.codingconception.com/python-examples/write-a-program-to-delete-comment-lines-from-a-file-in-python/
-    def minifyAndReplaceFile(self, sourceFile, destFile):
-        import python_minifier
+    # runs the build the command line would run and returns its BuildResult, with the errors recorded
+    # instead of raised. An instance runs one build at a time, concurrent builds need an instance each
+    def build(self, sourceDir, destDir, otaPackage=False, baseManifestFile=None):
+        result = BuildResult(sourceDir, destDir)
+        self.sizeReport = None
+        try:
+            if self.variants:
+                self.run_variants(sourceDir, destDir)
+            elif self.targets:
+                self.run_targets(sourceDir, destDir, baseManifestFile)
+            elif otaPackage:
+                self.run_package(sourceDir, destDir, baseManifestFile)
+            else:
+                self.run(sourceDir, destDir)
+        except Exception as e:
+            logging.debug(traceback.format_exc())
+            logging.error("build of {} failed: {}".format(sourceDir, e))
+            result.errors.append("{}: {}".format(type(e).__name__, e))
+        result = self.collectResult(result)
+        if profiler.current() is not None:
+            result.profile = profiler.current().asDict()
+        return result
+
+    def collectResult(self, result):
+        result.timings = dict(self.timings)
+        if self.targets:
+            for target in self.targets:
+                freezer = self.targetFreezers.get(target["name"])
+                if freezer is not None:
+                    targetDestDir = join(result.destDir, target.get("destination", target["name"]))
+                    targetResult = freezer.collectResult(BuildResult(result.sourceDir, targetDestDir))
+                    result.targets[target["name"]] = targetResult
+                    result.cacheHits += targetResult.cacheHits
+                    result.cacheMisses += targetResult.cacheMisses
+            return result
+
+        if self.variants:
+            for variant in self.variants:
+                freezer = self.variantFreezers.get(variant["name"])
+                if freezer is not None:
+                    variantDestDir = join(result.destDir, variant.get("destination", variant["name"]))
+                    variantResult = freezer.collectResult(BuildResult(result.sourceDir, variantDestDir))
+                    result.variants[variant["name"]] = variantResult
+                    result.cacheHits += variantResult.cacheHits
+                    result.cacheMisses += variantResult.cacheMisses
+            if self.fleetReport is not None:
+                result.dedupRatio = self.fleetReport["dedupRatio"]
+
+        if self.manifest is not None:
+            result.md5sum = self.manifest["md5sum"]
+            result.files = list(self.manifest["files"])
+        result.package = self.packageFile
+        result.solid = self.solidStats
+        # an exceeded budget fails the build, after its outputs are written so that they can be inspected
+        if self.sizeReport is not None:
+            result.report = self.sizeReport.asDict()
+            for message in self.sizeReport.exceededBudgets():
+                logging.error(message)
+                result.errors.append(message)
+        if self.cache is not None and not self.variants:
+            result.cacheHits = self.cache.hits
+            result.cacheMisses = self.cache.misses
+        for path in sorted(self.outputs):
+            try:
+                result.outputs[os.path.relpath(path, result.destDir).replace(os.sep, "/")] = os.path.getsize(path)
+            except OSError:
+                pass
+        return result
+
+    # builds every target of the "targets" list from a single set of transformed files: each source file
+    # goes through its pipeline stages once, and is compressed once for all the frozen targets that use
+    # the same stages and compression options. The outputs of each target go to its own folder of destDir
+    def run_targets(self, sourceDir, destDir, baseManifestFile=None):
+        self.timings = {}
+        self.resultStore = {}
+        self.loadSourceMatcher(sourceDir)
+        mkdir(destDir)
+        names = [target["name"] for target in self.targets]
+        if len(set(names)) != len(names):
+            raise ValueError("the names of the targets are not unique")
+        try:
+            for target in self.targets:
+                name = target["name"]
+                freezer = self.targetFreezers.get(name)
+                if freezer is None:
+                    freezer = MicroFreezer(TargetConfig(self.config, target))
+                    self.targetFreezers[name] = freezer
+                freezer.jobs = self.jobs
+                freezer.sharedPool = self.sharedPool
+                freezer.memoryCache = self.memoryCache
+                freezer.enableCache = self.enableCache
+                freezer.incremental = self.incremental
+                freezer.resultStore = self.resultStore
+
+                targetDestDir = join(destDir, target.get("destination", name))
+                targetType = target.get("type", "frozen")
+                logging.info("[targets]: building {} ({}) in {}".format(name, targetType, targetDestDir))
+                started = time.perf_counter()
+                if targetType == "ota":
+                    freezer.run_package(sourceDir, targetDestDir, target.get("base", baseManifestFile))
+                elif targetType == "frozen":
+                    freezer.run(sourceDir, targetDestDir)
+                else:
+                    raise ValueError("unknown type of target {}: {}".format(name, targetType))
+                self.timings[name] = time.perf_counter() - started
+            logging.info("[targets]: built {} targets from {} shared results".format(len(self.targets), len(self.resultStore)))
+        finally:
+            self.resultStore = None
+
+    # builds the variants of the "variants" list in one pass: each variant is the project with the files of its
+    # overlay folder added or replacing the ones of the project, without the files matching its "remove"
+    # patterns, and with its own configuration keys. The files the variants ship, as transformed by the
+    # pipeline stages, are stored once in a content addressed store, objects/<hash[:2]>/<hash>, which the
+    # package manifest of each variant refers to by hash
+    def run_variants(self, sourceDir, destDir):
+        if self.targets:
+            raise ValueError("targets and variants can not be combined")
+        names = [variant["name"] for variant in self.variants]
+        if len(set(names)) != len(names):
+            raise ValueError("the names of the variants are not unique")
+        self.timings = {}
+        self.manifest = None
+        self.packageFile = None
+        self.fleetReport = None
+        self.resultStore = {}
+        self.baseSourceDir = sourceDir
+        self.loadSourceMatcher(sourceDir)
+        self.baseDestDir = destDir
+        self.prepareDestination()
+        storeDir = join(destDir, VARIANT_STORE_DIR)
+        mkdir(storeDir)
 
-        with open(sourceFile) as f:
-            contents = python_minifier.minify(
-                f.read(),
-                remove_annotations=True,
-                remove_pass=False,
-                remove_literal_statements=True,
-                combine_imports=True,
-                hoist_literals=True,
-                rename_locals=True,
-                preserve_locals=None,
-                rename_globals=False,
-                preserve_globals=None,
-                remove_object_base=False,
-                convert_posargs_to_args=False,
-                preserve_shebang=True,
+        report = {"variants": {}}
+        objectSizes = {}
+        referencedSize = 0
+        try:
+            for variant in self.variants:
+                name = variant["name"]
+                freezer = self.variantFreezers.get(name)
+                if freezer is None:
+                    freezer = MicroFreezer(TargetConfig(self.config, variant))
+                    self.variantFreezers[name] = freezer
+                freezer.jobs = self.jobs
+                freezer.sharedPool = self.sharedPool
+                freezer.memoryCache = self.memoryCache
+                freezer.enableCache = self.enableCache
+                freezer.resultStore = self.resultStore
+
+                overlay = variant.get("overlay")
+                logging.info("[variants]: building {}".format(name))
+                started = time.perf_counter()
+                overlayDir = join(sourceDir, overlay) if overlay else None
+                manifest = freezer.run_variant(sourceDir, overlayDir, variant.get("remove", []))
+                for fileHash, source in freezer.variantObjects.items():
+                    self.storeObject(storeDir, fileHash, source)
+
+                variantDestDir = join(destDir, variant.get("destination", name))
+                mkdir(variantDestDir)
+                self.writeOutput(join(variantDestDir, PACKAGE_MANIFEST_FILE), json.dumps(manifest, indent=1))
+                size = sum(entry["size"] for entry in manifest["files"])
+                referencedSize += size
+                for entry in manifest["files"]:
+                    objectSizes[entry["hash"]] = entry["size"]
+                report["variants"][name] = {"md5sum": manifest["md5sum"], "files": len(manifest["files"]), "size": size}
+                self.timings[name] = time.perf_counter() - started
+        finally:
+            self.resultStore = None
+
+        storedSize = sum(objectSizes.values())
+        report["objects"] = len(objectSizes)
+        report["referencedSize"] = referencedSize
+        report["storedSize"] = storedSize
+        report["dedupRatio"] = referencedSize / storedSize if storedSize else 1.0
+        self.fleetReport = report
+        self.writeOutput(join(destDir, VARIANT_REPORT_FILE), json.dumps(report, indent=1))
+        logging.info(
+            "[variants]: {} variants refer to {} bytes in {} objects of {} bytes, dedup ratio: {:.2f}".format(
+                len(self.variants), referencedSize, len(objectSizes), storedSize, report["dedupRatio"]
             )
-        with open(destFile, "w") as fp:
-            fp.writelines(contents)
-
-    def convertFileToBase64(self, sourceFile, destFile):
-        tmp_file = None
-        if self.minify and sourceFile.endswith(".py") and not isAnySubstringInString(self.minifyExcludeFolderList, sourceFile):
-            import uuid
+        )
+        self.removeStaleOutputs((storeDir,))
+        logging.info("Operation completed successfully.")
 
-            tmp_file = "/tmp/" + str(uuid.uuid1()) + ".py"
-            logging.debug("  [M]: " + str(sourceFile))
-            self.minifyAndReplaceFile(sourceFile, tmp_file)
-            sourceFile = tmp_file
+    # objects are named by the hash of their contents, so an object that exists is never written again
+    def storeObject(self, storeDir, fileHash, source):
+        objectFile = join(storeDir, fileHash[:2], fileHash)
+        self.outputs.add(os.path.abspath(objectFile))
+        if os.path.exists(objectFile):
+            return
+        mkdir(os.path.dirname(objectFile))
+        tmp_file_name = objectFile + ".tmp"
+        if isinstance(source, bytes):
+            writeToFile(tmp_file_name, source, True)
+        else:
+            copyfile(source, tmp_file_name)
+        os.replace(tmp_file_name, objectFile)
+        self.rewrittenOutputs += 1
+
+    # plans and prepares the files of a variant of run_variants, returning its package manifest. The
+    # contents of the files to store are left in variantObjects by hash, as bytes or as the path of a
+    # source file that ships unchanged
+    def run_variant(self, sourceDir, overlayDir, removed):
+        self.timings = {}
+        self.manifest = None
+        self.packageFile = None
+        self.baseManifest = None
+        self.packagePlan = []
+        self.variantObjects = {}
+        self.outputs = set()
+        self.baseSourceDir = sourceDir
+        self.overlayDir = overlayDir
+        self.loadSourceMatcher(sourceDir)
 
-        logging.debug("  [C]: " + str(sourceFile))
+        self.detectPrecompiler()
+        self.openCache()
+        try:
+            self.timeStage("walk", self.planVariant, sourceDir, overlayDir, removed)
+            self.manifest = self.timeStage("prepare", self.prepareVariant)
+        finally:
+            self.shutdownExecutor()
+            self.closeCache()
+        return self.manifest
+
+    def planVariant(self, sourceDir, overlayDir, removed):
+        self.planPackage(sourceDir)
+        files = {archiveName: sourceFile for sourceFile, archiveName in self.packagePlan if sourceFile is not None}
+        if overlayDir is not None:
+            self.packagePlan = []
+            self.planPackage(overlayDir)
+            files.update((archiveName, sourceFile) for sourceFile, archiveName in self.packagePlan if sourceFile is not None)
+        removedMatcher = PathMatcher(removed)
+        self.packagePlan = [(files[name], name) for name in sorted(files) if not removedMatcher.match(name)]
+
+    def prepareVariant(self):
+        entries = []
+        for sourceFile, archiveName, contents, key, digest in self.packageEntries(True):
+            if contents is not None:
+                prepared = contents.result()
+                if key is not None:
+                    self.cache.putRecord(key, prepared)
+                archiveName = prepared["destFile"]
+                fileHash = prepared["hash"]
+                size = len(prepared["payload"])
+                self.variantObjects[fileHash] = prepared["payload"]
+            else:
+                fileHash = digest.result()
+                size = os.path.getsize(sourceFile)
+                self.variantObjects[fileHash] = sourceFile
+            entries.append({"path": archiveName, "size": size, "hash": fileHash})
+        entries.sort(key=lambda entry: entry["path"])
+        return {"md5sum": merkleRoot(entries), "flashRoot": self.flashRootFolder, "files": entries}
+
+    # the results shared by the targets of run_targets and the variants of run_variants are kept in memory, by the kind
+    # of result, the source file and the options that produced it
+    def storeKey(self, kind, sourceFile, *options):
+        if self.resultStore is None:
+            return None
+        return (kind, sourceFile, repr(options))
+
+    def fromStore(self, key):
+        return self.resultStore.get(key) if key is not None else None
+
+    def toStore(self, key, result):
+        if key is not None:
+            self.resultStore[key] = result
+
+    # stores the result of a task once it is done, unless it failed
+    def toStoreWhenDone(self, key, future):
+        future.add_done_callback(lambda done: self.toStore(key, done.result()) if done.exception() is None else None)
+
+    # builds the project and rebuilds it incrementally on every change of the source tree, until interrupted.
+    # With the build cache enabled, only the changed files are converted again
+    def watch(self, sourceDir, destDir, otaPackage=False, baseManifestFile=None):
+        from aux_files.watcher import SourceWatcher
+
+        def build():
+            if not self.build(sourceDir, destDir, otaPackage, baseManifestFile).ok:
+                logging.error("[watch]: build failed")
+
+        self.incremental = True
+        build()
+        watcher = SourceWatcher(sourceDir, self.sourceMatcher, [destDir])
+        try:
+            while True:
+                changes = watcher.wait()
+                logging.info("[watch]: {} changed paths, rebuilding".format(len(changes)))
+                for path in changes:
+                    logging.debug("[watch]: changed: {}".format(path))
+                build()
+        except KeyboardInterrupt:
+            logging.info("[watch]: stopped")
+        finally:
+            watcher.close()
+
+    # incremental builds keep the previous outputs, rewrite the ones that changed and remove the
+    # stale ones at the end, instead of starting from an empty destination
+    def prepareDestination(self):
+        self.outputs = set()
+        self.rewrittenOutputs = 0
+        mkdir(self.baseDestDir)
+        if not self.incremental:
+            logging.info("deleting old files from {}".format(self.baseDestDir))
+            removeContents(self.baseDestDir, listdir(self.baseDestDir))
+
+    def writeOutput(self, destination, content, open_binary=False):
+        self.outputs.add(os.path.abspath(destination))
+        if profiler.call("write", writeToFileIfChanged, destination, content, open_binary, bytesIn=len(content)):
+            self.rewrittenOutputs += 1
+
+    # removes the files of the destination that the build did not produce, along with the folders
+    # left empty, apart from the ones in keptDirectories
+    def removeStaleOutputs(self, keptDirectories=()):
+        if not self.incremental:
+            return
+        kept = set(os.path.abspath(d) for d in keptDirectories) | {os.path.abspath(self.baseDestDir)}
+        removed = 0
+        for directory, _, files in os.walk(self.baseDestDir, topdown=False):
+            for f in files:
+                path = os.path.abspath(join(directory, f))
+                if path not in self.outputs:
+                    removeFile(path)
+                    removed += 1
+            if os.path.abspath(directory) not in kept and not listdir(directory):
+                os.rmdir(directory)
+        logging.info(
+            "[incremental]: {} outputs rewritten, {} unchanged, {} removed".format(
+                self.rewrittenOutputs, len(self.outputs) - self.rewrittenOutputs, removed
+            )
+        )
 
-        bytes = readFromFile(sourceFile, True)
+    # checks that mpy-cross can be run, otherwise the build falls back to shipping source files
+    def detectPrecompiler(self):
+        usedByPipeline = any("precompile" in stageNames(stages) for _, stages in self.pipelineRules)
+        if not (self.precompile or usedByPipeline) or self.mpyCrossVersion is not None:
+            return
+        import subprocess
 
-        if self.minify and tmp_file is not None:
+        try:
+            result = subprocess.run([self.mpyCrossPath, "--version"], capture_output=True)
+            self.mpyCrossVersion = result.stdout.decode().strip()
+            logging.info("[precompile]: using {}".format(self.mpyCrossVersion))
+        except OSError:
+            logging.warning("[precompile]: {} is not available, shipping source files".format(self.mpyCrossPath))
+            self.precompile = False
+
+    def shouldPrecompile(self, sourceFile):
+        return (
+            self.precompile
+            and sourceFile.endswith(".py")
+            and not self.precompileExcludeList.match(sourceFile, self.sourcePath(sourceFile))
+        )
+
+    def shouldMinify(self, sourceFile):
+        return (
+            self.minify
+            and sourceFile.endswith(".py")
+            and not self.minifyExcludeFolderList.match(sourceFile, self.sourcePath(sourceFile))
+        )
+
+    # the patterns of excludeList, after the ones of the .gitignore of the project when useGitignore is set
+    def loadSourceMatcher(self, sourceDir):
+        self.sourceMatcher = PathMatcher()
+        if self.useGitignore and self.sourceMatcher.addFile(join(sourceDir, ".gitignore")):
+            logging.info("using the patterns of {}".format(join(sourceDir, ".gitignore")))
+        self.sourceMatcher.add(self.excludeList)
+
+    # the path of a file relative to the project root, with "/" separators
+    def sourcePath(self, path):
+        root = self.baseSourceDir
+        # the files of the overlay of a variant take the place of the ones of the project
+        if self.overlayDir is not None and path.startswith(join(self.overlayDir, "")):
+            root = self.overlayDir
+        prefix = join(root, "")
+        path = path[len(prefix) :] if path.startswith(prefix) else os.path.relpath(path, root)
+        return path.replace(os.sep, "/")
+
+    def isExcluded(self, path, isDirectory=False):
+        return self.sourceMatcher.match(self.sourcePath(path), isDirectory)
+
+    # lists the (name, path, isFile) entries of a folder of the project sorted by name, without the
+    # excluded ones, so that excluded folders are never walked into
+    def listSource(self, sourceDir):
+        entries = []
+        with os.scandir(sourceDir) as it:
+            for entry in it:
+                isFile = entry.is_file()
+                if self.isExcluded(entry.path, not isFile):
+                    logging.debug("ignoring file: {}".format(entry.name))
+                    continue
+                entries.append((entry.name, entry.path, isFile))
+        entries.sort()
+        return entries
+
+    # a stage of the configuration is either its name or {"name": ..., "options": {...}}
+    def stageSpec(self, stage):
+        if isinstance(stage, str):
+            name, options = stage, {}
+        else:
+            name, options = stage["name"], dict(stage.get("options", {}))
+        if name == "precompile":
+            options.setdefault("mpyCrossPath", self.mpyCrossPath)
+            options.setdefault("mpyCrossArgs", list(self.mpyCrossArgs))
+        return (name, options)
+
+    # returns the pipeline stages of a file as (name, options) pairs: the stages of the first rule of
+    # "pipeline" with a pattern matching the path of the file in the project, or else minify and precompile
+    # as set by their own configuration keys. Frozen copies are not precompiled, the firmware build compiles them
+    def fileStages(self, sourceFile, frozenCopy=False):
+        path = self.sourcePath(sourceFile)
+        stages = None
+        for matcher, ruleStages in self.pipelineRules:
+            if matcher.match(path):
+                stages = ruleStages
+                break
+        if stages is None:
+            stages = []
+            if self.shouldMinify(sourceFile):
+                stages.append(self.stageSpec("minify"))
+            if self.shouldPrecompile(sourceFile):
+                stages.append(self.stageSpec("precompile"))
+        if frozenCopy or self.mpyCrossVersion is None:
+            stages = [stage for stage in stages if stage[0] != "precompile"]
+        return tuple(stages)
+
+    # returns the process pool for the tasks of the build, or None when they run serially: the pool of the
+    # build daemon shared by its builds, or else a pool of the build started when more than one job is requested
+    def taskPool(self):
+        if self.sharedPool is not None:
+            return self.sharedPool
+        jobs = self.jobs if self.jobs > 0 else os.cpu_count()
+        if jobs <= 1:
+            return None
+
+        if self.executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            logging.debug("starting process pool with {} workers".format(jobs))
+            self.executor = ProcessPoolExecutor(max_workers=jobs)
+        return self.executor
+
+    # runs function for every argument tuple of tasks and returns the results in the order of tasks,
+    # either serially or through the process pool
+    def mapTasks(self, function, tasks):
+        pool = self.taskPool() if len(tasks) >= 2 else None
+        buildProfiler = profiler.current()
+        if pool is None and buildProfiler is not None:
+            return [buildProfiler.runTask(function, *task) for task in tasks]
+        if pool is None:
+            return [function(*task) for task in tasks]
+
+        jobs = self.jobs if self.jobs > 0 else os.cpu_count()
+        chunksize = max(1, len(tasks) // (jobs * 4))
+        if buildProfiler is not None:
+            return buildProfiler.mapTasks(pool, function, tasks, chunksize)
+        return list(pool.map(function, *zip(*tasks), chunksize=chunksize))
+
+    # submits a single task and returns its future, the task runs immediately when no pool is used
+    def submitTask(self, function, *args):
+        pool = self.taskPool()
+        buildProfiler = profiler.current()
+        if pool is None:
+            from concurrent.futures import Future
+
+            future = Future()
             try:
-                import os
-
-                # os.remove(tmp_file)
+                future.set_result(buildProfiler.runTask(function, *args) if buildProfiler is not None else function(*args))
             except Exception as e:
-                logging.exception(e, "Error deleting file [{}]".format(tmp_file))
+                future.set_exception(e)
+            return future
+        if buildProfiler is not None:
+            return buildProfiler.submitTask(pool, function, *args)
+        return pool.submit(function, *args)
+
+    def shutdownExecutor(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def openCache(self):
+        self.cache = None
+        if self.enableCache:
+            try:
+                self.cache = BuildCache(self.cacheDir, self.cacheMaxSize, self.memoryCache)
+            except OSError:
+                logging.warning("unable to open build cache at {}, continuing without it".format(self.cacheDir))
 
-        if self.enableZlibCompression:
-            import zlib
+    def closeCache(self):
+        if self.cache is not None:
+            self.cache.logStats()
+            self.cache.evict()
 
-            bytes = zlib.compress(bytes, 4)
-        newFileName = join(self.defrostFolderPath, "base64_" + str(self.convertedFileNumber) + ".py")
+    def minifierVersion(self):
+        try:
+            from importlib.metadata import version
+
+            return version("python-minifier")
+        except Exception:
+            return None
+
+    # the cache key of a file includes its stages and every option that affects its transformed payload
+    def cacheKey(self, sourceFile, stages, *options):
+        if self.cache is None:
+            return None
+        names = stageNames(stages)
+        if "minify" in names:
+            options += (self.minifierVersion(),)
+        if "precompile" in names:
+            options += (self.mpyCrossVersion,)
+        if self.pipelinePlugins:
+            options += (pluginVersions(self.pipelinePlugins),)
+        return self.cache.key(readFromFile(sourceFile, True), stages, *options)
+
+    # frozen bytes objects are read directly from flash, base64 strings need to be decoded in RAM first
+    def encodeData(self, payload):
+        if self.encoding == "bytes":
+            return profiler.call("encode", repr, payload, bytesIn=len(payload))
+        return str(profiler.call("encode", binascii.b2a_base64, payload, bytesIn=len(payload)))
+
+    # chunked payloads are stored as a tuple with each chunk encoded separately
+    def encodeResult(self, result):
+        if result["chunks"] is None:
+            return self.encodeData(result["payload"])
+        return "({},)".format(", ".join(self.encodeData(chunk) for chunk in splitChunks(result)))
+
+    def devicePath(self, result):
+        return join(self.flashRootFolder, result["destFile"])
+
+    # assigns the number of the base64_<n>.py module of every file. Incremental builds keep the numbers of
+    # the previous build for the files that still exist and give the numbers of the removed files to the
+    # new files, or to the last modules, since the device stops defrosting at the first missing number
+    def assignModuleNumbers(self, destFiles):
+        previous = self.moduleNumbers if self.incremental else {}
+        numbers = {f: previous[f] for f in destFiles if previous.get(f, len(destFiles)) < len(destFiles)}
+        free = sorted(set(range(len(destFiles))) - set(numbers.values()))
+        numbers.update(zip([f for f in destFiles if f not in numbers], free))
+        self.moduleNumbers = numbers
+        return numbers
+
+    def writeBase64File(self, number, destFile, result):
+        newFileName = join(self.defrostFolderPath, "base64_" + str(number) + ".py")
+        contents = 'PATH="{}"\nHASH="{}"\nCODEC="{}"\nDATA={}'.format(
+            self.devicePath(result), result["hash"], result["codec"], self.encodeResult(result)
+        )
+        self.writeOutput(newFileName, contents)
+
+    # packs the payloads of consecutive files into bundle_<n>.py modules of up to bundleMaxSize bytes,
+    # each one with an index of (path, offset, length, codec, hash) entries into its DATA.
+    # Chunked files get a bundle of their own, with DATA being the tuple of their chunks.
+    # With solidBlockSize, the compressed files that fit are grouped in blocks instead, see writeSolidBlocks
+    def writeBundles(self, results):
+        bundle = []
+        bundleSize = 0
+        blocks = []
+        blockSize = 0
+        for (_, destFile), result in zip(self.filePlan, results):
+            if result["chunks"] is not None:
+                self.writeBundleFile([(destFile, result)])
+                continue
+            if self.solidBlockSize and result["codec"] == "zlib" and result["fileSize"] <= self.solidBlockSize:
+                if not blocks or blockSize + result["fileSize"] > self.solidBlockSize:
+                    blocks.append([])
+                    blockSize = 0
+                blocks[-1].append((destFile, result))
+                blockSize += result["fileSize"]
+                continue
+            if bundle and bundleSize + result["payloadSize"] > self.bundleMaxSize:
+                self.writeBundleFile(bundle)
+                bundle = []
+                bundleSize = 0
+            bundle.append((destFile, result))
+            bundleSize += result["payloadSize"]
+        if bundle:
+            self.writeBundleFile(bundle)
+        if self.solidBlockSize:
+            self.writeSolidBlocks(blocks)
+
+    # a solid block is compressed as a single stream, so the small files share one zlib header and each
+    # one can refer to the contents of the files before it. Its bundle has CODEC="zlib", and the INDEX
+    # points into the decompressed DATA, which the device decompresses once for all of them. A block that
+    # does not compress better than its files on their own is written as a regular bundle
+    def writeSolidBlocks(self, blocks):
+        contents = [b"".join(decompressPayload(result) for _, result in block) for block in blocks]
+        tasks = [(data, self.compressionLevels, self.compressionWindowBits) for data in contents]
+        perFileSize = 0
+        solidSize = 0
+        solidFiles = 0
+        solidBlocks = 0
+        largestBlock = 0
+        for block, (codec, _, _, compressed) in zip(blocks, self.mapTasks(selectCodec, tasks)):
+            payloadSize = sum(result["payloadSize"] for _, result in block)
+            perFileSize += payloadSize
+            if codec != "zlib" or len(compressed) >= payloadSize:
+                self.writeBundleFile(block)
+                solidSize += payloadSize
+                continue
+            self.writeBundleFile(block, compressed)
+            self.shareBlock(block, len(compressed))
+            solidSize += len(compressed)
+            solidFiles += len(block)
+            solidBlocks += 1
+            largestBlock = max(largestBlock, len(compressed))
+
+        saved = perFileSize - solidSize
+        self.solidStats = {
+            "blocks": solidBlocks,
+            "files": solidFiles,
+            "perFileSize": perFileSize,
+            "solidSize": solidSize,
+            "savedBytes": saved,
+            "largestBlock": largestBlock,
+        }
+        logging.info(
+            "[solid]: {} files in {} blocks, firmware payload size: {} bytes, "
+            "{} bytes ({:.1%}) less than per-file compression".format(
+                solidFiles, solidBlocks, solidSize, saved, saved / perFileSize if perFileSize else 0.0
+            )
+        )
+
+    # splits the compressed size of a solid block between its files, in proportion to their size, for the size report
+    def shareBlock(self, block, compressedSize):
+        blockSize = sum(result["fileSize"] for _, result in block)
+        remaining = compressedSize
+        for destFile, result in block[:-1]:
+            share = compressedSize * result["fileSize"] // blockSize if blockSize else 0
+            self.solidShares[destFile] = share
+            remaining -= share
+        self.solidShares[block[-1][0]] = remaining
+
+    # block is the compressed contents of the files of a solid block, see writeSolidBlocks
+    def writeBundleFile(self, bundle, block=None):
+        newFileName = join(self.defrostFolderPath, "bundle_" + str(self.convertedFileNumber) + ".py")
         self.convertedFileNumber += 1
-        contents = 'PATH="{}"\nDATA={}'.format(join(self.flashRootFolder, destFile), binascii.b2a_base64(bytes))
-        writeToFile(newFileName, contents)
+        index = []
+        offset = 0
+        for destFile, result in bundle:
+            if block is None:
+                index.append((self.devicePath(result), offset, result["payloadSize"], result["codec"], result["hash"]))
+                offset += result["payloadSize"]
+            else:
+                index.append((self.devicePath(result), offset, result["fileSize"], "store", result["hash"]))
+                offset += result["fileSize"]
+        if block is not None:
+            contents = 'CODEC="zlib"\nINDEX={}\nDATA={}'.format(repr(tuple(index)), self.encodeData(block))
+        elif len(bundle) == 1:
+            contents = "INDEX={}\nDATA={}".format(repr(tuple(index)), self.encodeResult(bundle[0][1]))
+        else:
+            data = self.encodeData(b"".join(result["payload"] for _, result in bundle))
+            contents = "INDEX={}\nDATA={}".format(repr(tuple(index)), data)
+        self.writeOutput(newFileName, contents)
+        logging.debug("bundle {}: {} files, {} bytes".format(newFileName, len(bundle), offset))
+
+    # the file plan is converted as a whole and written in plan order, so the numbering of the
+    # generated modules does not depend on how the work is scheduled
+    def convertFiles(self):
+        logging.info("Converting {} files...".format(len(self.filePlan)))
+        results = [None] * len(self.filePlan)
+        keys = [None] * len(self.filePlan)
+        storeKeys = [None] * len(self.filePlan)
+        pending = []
+        pendingCompression = []
+        for index, (sourceFile, destFile) in enumerate(self.filePlan):
+            stages = self.fileStages(sourceFile)
+            task = (
+                sourceFile,
+                destFile,
+                stages,
+                self.pipelinePlugins,
+                self.enableZlibCompression,
+                self.chunkSize,
+                self.compressionLevels,
+                self.compressionWindowBits,
+                self.compressionMinSaving,
+            )
+            storeKeys[index] = self.storeKey("payload", *task)
+            results[index] = self.fromStore(storeKeys[index])
+            if results[index] is None:
+                keys[index] = self.cacheKey(sourceFile, stages, "payload", destFile, *task[4:])
+                if keys[index] is not None:
+                    results[index] = self.cache.getRecord(keys[index])
+            if results[index] is None:
+                prepared = self.fromStore(self.storeKey("contents", *task[:4]))
+                if prepared is not None:
+                    pendingCompression.append((index, (sourceFile, prepared) + task[4:]))
+                else:
+                    pending.append((index, task + (self.resultStore is not None,)))
+
+        computed = list(zip(pending, self.mapTasks(convertFileToBase64, [task for _, task in pending])))
+        computed += zip(pendingCompression, self.mapTasks(compressFileContents, [task for _, task in pendingCompression]))
+        for (index, task), result in computed:
+            if "contents" in result:
+                self.toStore(self.storeKey("contents", *task[:4]), result.pop("contents"))
+            results[index] = result
+            if keys[index] is not None:
+                self.cache.putRecord(keys[index], result)
+
+        for index, result in enumerate(results):
+            self.toStore(storeKeys[index], result)
+
+        for result in results:
+            path = result["destFile"].replace(os.sep, "/")
+            self.manifestEntries.append({"path": path, "size": result["fileSize"], "hash": result["hash"]})
+
+        if self.layout == "bundle":
+            self.writeBundles(results)
+        else:
+            numbers = self.assignModuleNumbers([destFile for _, destFile in self.filePlan])
+            for (_, destFile), result in zip(self.filePlan, results):
+                self.writeBase64File(numbers[destFile], destFile, result)
+        for (_, destFile), result in zip(self.filePlan, results):
+            compressedSize = self.solidShares.get(destFile, result["payloadSize"])
+            self.sizeReport.addFile(
+                result["destFile"].replace(os.sep, "/"),
+                "todefrost",
+                result["sourceSize"],
+                result["fileSize"],
+                compressedSize,
+                self.encodedSize(compressedSize),
+            )
+        self.logEncodingStats(results)
+        self.logCodecStats(results)
+
+    # the bytes that a payload takes in the firmware: bytes literals are frozen as they are, base64 strings grow by a third
+    def encodedSize(self, payloadSize):
+        if self.encoding == "bytes":
+            return payloadSize
+        return 4 * ((payloadSize + 2) // 3)
+
+    def logCodecStats(self, results):
+        codecs = {}
+        for result in results:
+            codec = result["codec"] if result["codec"] == "store" else "zlib-{}-{}".format(result["level"], result["windowBits"])
+            codecs[codec] = codecs.get(codec, 0) + 1
+        logging.info("[codecs]: " + ", ".join("{}: {} files".format(codec, count) for codec, count in sorted(codecs.items())))
+
+    # compares the firmware size and the defrost RAM needs of the selected encoding with the alternative
+    def logEncodingStats(self, results):
+        payloadSize = sum(result["payloadSize"] for result in results)
+        base64Size = sum(4 * ((result["payloadSize"] + 2) // 3) for result in results)
+        maxPayloadSize = max([max(result["chunks"] or [result["payloadSize"]]) for result in results] + [0])
+        if self.solidStats:
+            # the base64 size of the solid blocks is approximated from their payload size
+            payloadSize -= self.solidStats["savedBytes"]
+            base64Size -= 4 * self.solidStats["savedBytes"] // 3
+            maxPayloadSize = max(maxPayloadSize, self.solidStats["largestBlock"])
+        logging.info(
+            "[encoding]: selected: {}, firmware payload size: bytes: {} bytes, base64: {} bytes".format(
+                self.encoding, payloadSize, base64Size
+            )
+        )
+        logging.info(
+            "[encoding]: defrost decode buffer: bytes: 0 bytes (read from flash), base64: up to {} bytes".format(maxPayloadSize)
+        )
+        if self.chunkSize:
+            chunked = [result for result in results if result["chunks"] is not None]
+            maxFileBuffer = max([min(result["fileSize"], self.chunkSize) for result in results] + [0])
+            logging.info(
+                "[chunks]: {} chunked files, defrost decompression buffer: up to {} bytes".format(len(chunked), maxFileBuffer)
+            )
+
+    def copyFiles(self):
+        tasks = []
+        keys = []
+        for sourceFile, destFile in self.copyPlan:
+            stages = self.fileStages(sourceFile, frozenCopy=True)
+            relativePath = os.path.relpath(destFile, self.baseDestDirCustom).replace(os.sep, "/")
+            # only the files transformed by pipeline stages are worth caching, the rest are plain copies
+            storeKey = self.storeKey("copy", sourceFile, relativePath, stages) if stages else None
+            contents = self.fromStore(storeKey)
+            key = None
+            if contents is None and stages:
+                key = self.cacheKey(sourceFile, stages, "copy", relativePath)
+                contents = self.cache.get(key) if key is not None else None
+            self.outputs.add(os.path.abspath(destFile))
+            if contents is not None:
+                self.toStore(storeKey, contents)
+                self.writeOutput(destFile, contents, True)
+                self.reportFrozenFile(sourceFile, relativePath, contents)
+            else:
+                tasks.append((sourceFile, destFile, relativePath, stages, self.pipelinePlugins))
+                keys.append((key, storeKey, sourceFile, relativePath))
+
+        for (key, storeKey, sourceFile, relativePath), (contents, written) in zip(keys, self.mapTasks(copyFile, tasks)):
+            if written:
+                self.rewrittenOutputs += 1
+            if contents is not None:
+                self.toStore(storeKey, contents)
+            if key is not None and contents is not None:
+                self.cache.put(key, contents)
+            self.reportFrozenFile(sourceFile, relativePath, contents)
+
+    # the files of Custom/ are frozen as they are, contents is None for the ones copied without pipeline stages
+    def reportFrozenFile(self, sourceFile, relativePath, contents):
+        sourceSize = os.path.getsize(sourceFile)
+        size = len(contents) if contents is not None else sourceSize
+        self.sizeReport.addFile(relativePath, "frozen", sourceSize, size, None, size)
 
     def processFiles(self, currentPath=""):
         absoluteCurrentPath = join(self.baseSourceDir, currentPath)
 
-        try:
-            for f in listdir(absoluteCurrentPath):
-                if f in self.excludeList:
-                    logging.debug("ignoring file: {}".format(f))
-                    continue
-                absoluteSourceDir = join(absoluteCurrentPath, f)
+        for f, absoluteSourceDir, isFile in self.listSource(absoluteCurrentPath):
+            if isFile:
+                logging.debug("File: " + str(absoluteSourceDir))
+                self.filePlan.append((absoluteSourceDir, join(currentPath, f)))
+            else:
+                logging.debug("Dir:  " + str(absoluteSourceDir))
 
-                if isfile(absoluteSourceDir):
-                    logging.debug("File: " + str(absoluteSourceDir))
-                    self.convertFileToBase64(absoluteSourceDir, join(currentPath, f))
+                if f in self.directoriesKeptInFrozen:
+                    self.copyRecursive(absoluteSourceDir, self.baseDestDirCustom)
                 else:
-                    logging.debug("Dir:  " + str(absoluteSourceDir))
-
-                    if f in self.directoriesKeptInFrozen:
-                        self.copyRecursive(absoluteSourceDir, self.baseDestDirCustom)
-                    else:
-                        self.processFiles(join(currentPath, f))
-        except Exception as e:
-            logging.exception(e, "processFiles: Error processing file")
+                    self.processFiles(join(currentPath, f))
 
+    # creates the destination directories and adds the files to the copy plan, which is executed by copyFiles
     def copyRecursive(self, sourceDir, destDir, ignoreFrozenDirectories=False):
-        try:
-            for f in listdir(sourceDir):
-                if f in self.excludeList:
-                    logging.debug("ignoring file: {}".format(f))
+        for f, absoluteSourceDir, isFile in self.listSource(sourceDir):
+            absoluteDestDir = join(destDir, f)
+            if isFile:
+                self.copyPlan.append((absoluteSourceDir, absoluteDestDir))
+            elif not ignoreFrozenDirectories or f not in self.directoriesKeptInFrozen:
+                logging.debug("dir:  " + str(absoluteSourceDir))
+                mkdir(absoluteDestDir)
+                self.copyRecursive(absoluteSourceDir, absoluteDestDir)
+
+    # lists the files of each directory sorted by name, followed by its subdirectories, so that the
+    # package contents are in the same order on every filesystem
+    def planPackage(self, sourceDir, archiveDir=""):
+        directories = []
+        for f, absoluteSourceDir, isFile in self.listSource(sourceDir):
+            if isFile:
+                self.packagePlan.append((absoluteSourceDir, archiveDir + f))
+            elif archiveDir or f not in self.directoriesKeptInFrozen:
+                directories.append(f)
+
+        for f in directories:
+            logging.debug("dir:  " + str(join(sourceDir, f)))
+            self.packagePlan.append((None, archiveDir + f))
+            self.planPackage(join(sourceDir, f), archiveDir + f + "/")
+
+    # yields the entries of the package plan along with a future of their contents prepared by the
+    # pipeline stages and their cache key, keeping a bounded number of files in flight so
+    # that memory use does not depend on the project size. The hashes of the rest of the files are
+    # calculated in the pool too for delta packages, which need them before adding the file
+    def packageEntries(self, digests=False):
+        from collections import deque
+        from concurrent.futures import Future
+
+        window = max(1, self.jobs if self.jobs > 0 else os.cpu_count()) * 4
+        pending = deque()
+        for sourceFile, archiveName in self.packagePlan:
+            contents = None
+            key = None
+            digest = None
+            if sourceFile is not None:
+                stages = self.fileStages(sourceFile)
+            if sourceFile is not None and stages:
+                storeKey = self.storeKey("contents", sourceFile, archiveName, stages, self.pipelinePlugins)
+                cached = self.fromStore(storeKey)
+                if cached is None:
+                    key = self.cacheKey(sourceFile, stages, "contents", archiveName)
+                    cached = self.cache.getRecord(key) if key is not None else None
+                if cached is not None:
+                    self.toStore(storeKey, cached)
+                    contents = Future()
+                    contents.set_result(cached)
+                    key = None
+                else:
+                    contents = self.submitTask(prepareFileContents, sourceFile, archiveName, stages, self.pipelinePlugins)
+                    self.toStoreWhenDone(storeKey, contents)
+            elif sourceFile is not None and (digests or self.baseManifest is not None):
+                storeKey = self.storeKey("digest", sourceFile)
+                cached = self.fromStore(storeKey)
+                if cached is not None:
+                    digest = Future()
+                    digest.set_result(cached)
+                else:
+                    digest = self.submitTask(md5file, sourceFile)
+                    self.toStoreWhenDone(storeKey, digest)
+            pending.append((sourceFile, archiveName, contents, key, digest))
+            if len(pending) >= window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    # streams the planned files into the compressed tarball, without copying them to the destination
+    def createTarFile(self):
+        import tarfile
+        from io import BytesIO
+
+        # the members get no owner and a fixed modification time, which the device ignores anyway, so
+        # that the same files always produce the same package bytes
+        def fileInfo(name, size):
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mode = 0o644
+            return info
+
+        def addBytes(tar, name, data):
+            profiler.call("tar", tar.addfile, fileInfo(name, len(data)), BytesIO(data), bytesIn=len(data))
+
+        def addDirectory(tar, name):
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            tar.addfile(info)
+
+        baseEntries = None
+        if self.baseManifest is not None:
+            baseEntries = {entry["path"]: entry for entry in self.baseManifest["files"]}
+
+        tmp_file_name = join(self.baseDestDir, "package.tmp")
+        manifestEntries = []
+        unchanged = 0
+        with open(tmp_file_name, "wb") as out_file:
+            # a whole tarball is compressed as one stream, so it uses the strongest of the configured settings
+            writer = out_file
+            if self.enableZlibCompression:
+                writer = CompressedPackageWriter(out_file, max(self.compressionLevels), max(self.compressionWindowBits))
+            tar = tarfile.open(fileobj=writer, mode="w|")
+
+            # the delta description goes first, so that the device can refuse the package before extracting anything
+            if baseEntries is not None:
+                paths = set(archiveName for sourceFile, archiveName in self.packagePlan if sourceFile is not None)
+                # both names of precompiled files stay out of the delete list, the device itself removes
+                # a .py that would shadow a newly extracted .mpy
+                paths.update(
+                    mpyName(archiveName)
+                    for sourceFile, archiveName in self.packagePlan
+                    if sourceFile is not None and "precompile" in stageNames(self.fileStages(sourceFile))
+                )
+                delta = {"base": self.baseManifest["md5sum"], "delete": sorted(set(baseEntries) - paths)}
+                logging.info("delta package: {} deleted files".format(len(delta["delete"])))
+                addBytes(tar, PACKAGE_DELTA_FILE, json.dumps(delta).encode("utf-8"))
+
+            addedDirectories = set()
+            for sourceFile, archiveName, contents, key, digest in self.packageEntries():
+                if sourceFile is None:
+                    # in delta packages, directories are only added along with their changed files
+                    if baseEntries is None:
+                        addDirectory(tar, archiveName)
                     continue
 
-                absoluteSourceDir = join(sourceDir, f)
-                absoluteDestDir = join(destDir, f)
-                if isfile(absoluteSourceDir):
-                    if (
-                        self.minify
-                        and absoluteSourceDir.endswith(".py")
-                        and not isAnySubstringInString(self.minifyExcludeFolderList, absoluteSourceDir)
-                    ):
-                        logging.debug("file [M]: " + str(absoluteSourceDir))
-                        self.minifyAndReplaceFile(absoluteSourceDir, absoluteDestDir)
-                    else:
-                        logging.debug("file: " + str(absoluteSourceDir))
-                        copyfile(absoluteSourceDir, absoluteDestDir)
-                elif not ignoreFrozenDirectories or f not in self.directoriesKeptInFrozen:
-                    logging.debug("dir:  " + str(absoluteSourceDir))
-                    mkdir(absoluteDestDir)
-                    self.copyRecursive(absoluteSourceDir, absoluteDestDir)
-        except Exception as e:
-            logging.exception(e, "copyRecursive: Error processing file")
+                fileHash = None
+                if contents is not None:
+                    prepared = contents.result()
+                    if key is not None:
+                        self.cache.putRecord(key, prepared)
+                    data = prepared["payload"]
+                    archiveName = prepared["destFile"]
+                    logging.debug("file [M]: " + str(sourceFile))
+                    fileHash = prepared["hash"]
+                    size = len(data)
+                else:
+                    logging.debug("file: " + str(sourceFile))
+                    if digest is not None:
+                        fileHash = digest.result()
+                    size = os.path.getsize(sourceFile)
+
+                if baseEntries is not None:
+                    baseEntry = baseEntries.get(archiveName)
+                    if baseEntry is not None and baseEntry["size"] == size and baseEntry["hash"] == fileHash:
+                        manifestEntries.append({"path": archiveName, "size": size, "hash": fileHash})
+                        unchanged += 1
+                        continue
+                    parts = archiveName.split("/")
+                    for i in range(1, len(parts)):
+                        directory = "/".join(parts[:i])
+                        if directory not in addedDirectories:
+                            addDirectory(tar, directory)
+                            addedDirectories.add(directory)
+
+                # a member takes a 512 bytes header and is padded to 512 bytes in the tarball
+                tarSize = 512 + (size + 511) // 512 * 512
+                self.sizeReport.addFile(archiveName, "tarball", os.path.getsize(sourceFile), size, None, tarSize)
+                if contents is not None:
+                    addBytes(tar, archiveName, data)
+                else:
+                    with open(sourceFile, "rb") as in_file:
+                        # the hash is calculated while streaming, unless already done for the delta comparison
+                        hashes = (hashlib.md5(),) if fileHash is None else ()
+                        reader = HashingReader(in_file, hashes)
+                        profiler.call("tar", tar.addfile, fileInfo(archiveName, size), reader, bytesIn=size)
+                    if fileHash is None:
+                        fileHash = hashes[0].hexdigest()
+                manifestEntries.append({"path": archiveName, "size": size, "hash": fileHash})
+
+            manifestEntries.sort(key=lambda entry: entry["path"])
+            folderMd5 = profiler.call("md5", merkleRoot, manifestEntries)
+            manifest = {"md5sum": folderMd5, "files": manifestEntries}
+            if baseEntries is not None:
+                logging.info("delta package: {} changed, {} unchanged files".format(len(manifestEntries) - unchanged, unchanged))
+
+            addBytes(tar, "package_md5sum.py", 'md5sum="{}"'.format(folderMd5).encode("utf-8"))
+            addBytes(tar, PACKAGE_MANIFEST_FILE, json.dumps(manifest, indent=1).encode("utf-8"))
+            tar.close()
+            if self.enableZlibCompression:
+                writer.finish()
+
+        tar_file_name = "{}.tar{}".format(folderMd5, ".gz" if self.enableZlibCompression else "")
+        self.outputs.add(os.path.abspath(join(self.baseDestDir, tar_file_name)))
+        if sameContents(tmp_file_name, join(self.baseDestDir, tar_file_name)):
+            removeFile(tmp_file_name)
+        else:
+            os.replace(tmp_file_name, join(self.baseDestDir, tar_file_name))
+            self.rewrittenOutputs += 1
+        self.packageFile = join(self.baseDestDir, tar_file_name)
+        self.sizeReport.packageSize = os.path.getsize(self.packageFile)
+        logging.info("package created: {}".format(tar_file_name))
+        return manifest
 
     def finalize(self):
-        # create md5sum file for package identification
-        folderMd5 = md5folder(self.defrostFolderPath)
-        contents = 'md5sum="{}"'.format(folderMd5)
-        writeToFile(join(self.defrostFolderPath, "package_md5sum.py"), contents)
+        # create md5sum file for package identification, from the hashes of the files that get defrosted
+        self.manifestEntries.sort(key=lambda entry: entry["path"])
+        manifest = {"md5sum": profiler.call("md5", merkleRoot, self.manifestEntries), "files": self.manifestEntries}
+        self.manifest = manifest
+        contents = 'md5sum="{}"'.format(manifest["md5sum"])
+        self.writeOutput(join(self.defrostFolderPath, "package_md5sum.py"), contents)
+        self.writeOutput(join(self.baseDestDir, PACKAGE_MANIFEST_FILE), json.dumps(manifest, indent=1))
 
         # add microwave code responsible to defrost appropriate code upon pycom's first run after update
         microwave_file = "microwave.py"
         target_file = join(self.defrostFolderPath, microwave_file)
-        fileContents = readFromFile(join("aux_files", microwave_file))
+        fileContents = readFromFile(join(AUX_FILES_DIR, microwave_file))
         fileContents = fileContents.replace("/flash/package.md5", join(self.flashRootFolder, "package.md5"))
+        fileContents = fileContents.replace("/flash/package.idx", join(self.flashRootFolder, "package.idx"))
 
         # default: zlib enabled
         if not self.enableZlibCompression:
             fileContents = fileContents.replace("enableZlibCompression = True", "enableZlibCompression = False")
+        fileContents = fileContents.replace('encoding = "base64"', 'encoding = "{}"'.format(self.encoding))
+        fileContents = fileContents.replace('layout = "module"', 'layout = "{}"'.format(self.layout))
 
-        writeToFile(target_file, fileContents)
+        self.writeOutput(target_file, fileContents)
 
         # add call to _main that detects package changes and calls defrosting after
         # a firmware flash
         main_file = "_append_to_boot.py"
         target_file = join(self.baseDestDir, main_file)
-        fileContents = readFromFile(join("aux_files", main_file))
+        fileContents = readFromFile(join(AUX_FILES_DIR, main_file))
         fileContents = fileContents.replace("/flash/package.md5", join(self.flashRootFolder, "package.md5"))
-        writeToFile(target_file, fileContents)
-
-    def finalize_package(self):
-        # create md5sum file for package identification
-        folderMd5 = md5folder(self.baseDestDir)
-        contents = 'md5sum="{}"'.format(folderMd5)
-        writeToFile(join(self.baseDestDir, "package_md5sum.py"), contents)
-
-        self.createTarFile(folderMd5, self.baseDestDir)
+        self.writeOutput(target_file, fileContents)
+
+    # splits the package into chunks of otaChunkSize bytes, in the <md5>.chunks folder, along with the size and
+    # CRC32 of each chunk in chunks.json, so that the device can verify each chunk it receives and an interrupted
+    # transfer only needs the missing chunks. The last line of chunks.json is the CRC32 of the JSON before it
+    def splitPackage(self):
+        packageName = os.path.basename(self.packageFile)
+        chunksDir = join(self.baseDestDir, packageName.split(".")[0] + PACKAGE_CHUNKS_SUFFIX)
+        mkdir(chunksDir)
+        chunks = []
+        with open(self.packageFile, "rb") as f:
+            for index, data in enumerate(iter(partial(f.read, self.otaChunkSize), b"")):
+                self.writeOutput(join(chunksDir, str(index)), data, True)
+                chunks.append({"size": len(data), "crc32": binascii.crc32(data)})
+        header = {
+            "package": packageName,
+            "size": sum(chunk["size"] for chunk in chunks),
+            "chunkSize": self.otaChunkSize,
+            "chunks": chunks,
+        }
+        header = json.dumps(header, indent=1)
+        headerCrc = binascii.crc32(header.encode("utf-8"))
+        self.writeOutput(join(chunksDir, PACKAGE_CHUNKS_HEADER), "{}\n{:08x}\n".format(header, headerCrc))
+        logging.info("package split in {} chunks of {} bytes".format(len(chunks), self.otaChunkSize))
+
+    def finalize_package(self, manifest):
+        # keep a copy of the manifest next to the package to be used as base of future delta packages
+        self.writeOutput(join(self.baseDestDir, PACKAGE_MANIFEST_FILE), json.dumps(manifest, indent=1))
 
         main_file = "_apply_package.py"
         target_file = join(self.baseDestDir, main_file)
-        fileContents = readFromFile(join("aux_files", main_file))
+        fileContents = readFromFile(join(AUX_FILES_DIR, main_file))
         fileContents = fileContents.replace('flashRootFolder = "/flash"', 'flashRootFolder="' + self.flashRootFolder + '"')
-        writeToFile(target_file, fileContents)
+        if not self.otaStreamingExtract:
+            fileContents = fileContents.replace("streamingExtract = True", "streamingExtract = False")
+        fileContents = fileContents.replace("copyBufferSize = 512", "copyBufferSize = {}".format(self.otaCopyBufferSize))
+        self.writeOutput(target_file, fileContents)
 
-    def createTarFile(self, file_name, path):
-        import tarfile
 
-        cwd = os.getcwd()
-        os.chdir(path)
-        tar_file_name = "{}.tar".format(file_name)
-        files_to_include_in_tar = listdir(path)
-        tar = tarfile.open(tar_file_name, "w")
-        to_delete = []
-        for f in files_to_include_in_tar:
-            tar.add(f)
-            to_delete.append(f)
-        tar.close()
+# builds a project without depending on the working directory: config is a Config, a dict with the keys
+# of the configuration file or the path of one, and the defaults are used when it is omitted. Every call
+# uses a MicroFreezer of its own, so builds into different destinations can run concurrently in threads
+def build(sourceDir, destDir, config=None, otaPackage=False, baseManifestFile=None):
+    try:
+        if not isinstance(config, Config):
+            config = Config(config if config is not None else {})
+        freezer = MicroFreezer(config)
+    except Exception as e:
+        logging.debug(traceback.format_exc())
+        logging.error("configuration of the build of {} failed: {}".format(sourceDir, e))
+        result = BuildResult(sourceDir, destDir)
+        result.errors.append("{}: {}".format(type(e).__name__, e))
+        return result
+    return freezer.build(sourceDir, destDir, otaPackage, baseManifestFile)
+
+
+# writes the size reports of a build as JSON to reportFile and prints them as tables, a report per
+# target for multi-target builds
+def writeReport(result, reportFile):
+    from aux_files.report import formatReport
+
+    if result.targets:
+        reports = {name: target.report for name, target in result.targets.items() if target.report is not None}
+        writeToFile(reportFile, json.dumps({"targets": reports}, indent=1))
+        for name, report in reports.items():
+            print("[{}]".format(name))
+            print(formatReport(report))
+            print()
+    elif result.report is not None:
+        writeToFile(reportFile, json.dumps(result.report, indent=1))
+        print(formatReport(result.report))
+    else:
+        logging.warning("the build has no size report")
+
 
-        removeContents(path, to_delete)
+# imports the minifier and the pipeline plugins ahead of the builds, in the build daemon and its workers
+def warmUp(plugins=()):
+    try:
+        import python_minifier
+    except ImportError:
+        pass
+    loadPlugins(plugins)
+
+
+# runs the build daemon on a unix socket until interrupted. Between the builds it is asked for, it keeps
+# the configuration, a process pool with the minifier already imported and the recently used entries of
+# the build cache in memory. Requests without a configuration of their own use config
+def serve(socketPath, config, workers=2, jobs=0):
+    from concurrent.futures import ProcessPoolExecutor
+    from aux_files.cache import MemoryCache
+    from aux_files.server import BuildServer
+
+    plugins = tuple(config.get("pipelinePlugins", []))
+    warmUp(plugins)
+    jobs = jobs if jobs > 0 else os.cpu_count()
+    pool = None
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=warmUp, initargs=(plugins,))
+        # starts the worker processes before the threads of the server
+        pool.submit(warmUp, plugins).result()
+    memoryCache = MemoryCache(config.get("memoryCacheSize", 64 * 1024 * 1024))
+
+    def build(request):
+        freezer = MicroFreezer(config if request.get("config") is None else Config(request["config"]))
+        freezer.jobs = jobs
+        freezer.sharedPool = pool
+        freezer.memoryCache = memoryCache
+        if request.get("noCache"):
+            freezer.enableCache = False
+        result = freezer.build(request["source"], request["destination"], request.get("otaPackage", False), request.get("base"))
+        return result.asDict()
 
-        if self.enableZlibCompression:
-            try:
-                # try to compress file
-                import zlib
-
-                logging.debug("compressing file...")
-                bytes = zlib.compress(readFromFile(tar_file_name, True), 4)
-                crc = zlib.crc32(bytes) & 0xFFFFFFFF
-                # zlib 8 header bytes + data + crc 4 bytes
-                bytes = b"\x1f\x8b\x08\x00\x00\x00\x00\x00" + bytes + crc.to_bytes(length=4, byteorder="big")
-                if writeToFile("{}.gz".format(tar_file_name), bytes, True):
-                    removeFile(tar_file_name)
-            except Exception as e:
-                logging.debug("Error comressing tar file {}.".format(tar_file_name))
-                traceback.print_exc()
-        os.chdir(cwd)
+    try:
+        BuildServer(socketPath, build, workers, memoryCache).serveForever()
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
 
 def showHelp():
@@ -347,23 +1738,91 @@ Options and arguments:
 -c, --config        : explicitly specify configuration file path, if omitted "./config.json" will be used
 -s, --source        : the path to the source directory of the project
 -d, --destination   : the path to the destination folder where all the generated files will be placed
---ota-package       : generate OTA package instead, if omitted it will generate the files needed for micropython freezing
+--ota-package       : generate OTA package instead, if omitted it will generate the files needed for micropython freezing,
+                      ignored when the configuration lists "targets" or "variants"
+--base              : path to the package_manifest.json of a previous build, creates a delta OTA package against it
+--no-cache          : do not use the build cache of minified and compressed files
+--watch             : keep running and rebuild the outputs that are affected by every change of the source folder
+--profile           : log the calls, bytes in and out, wall and CPU time of each build stage and the slowest files
+--profile-top       : the number of slowest files logged by --profile (default: 10)
+--profile-trace     : write the profile of the build to the given file in the Chrome trace event format, implies --profile
+--profile-cprofile  : write the cProfile statistics of the main process to the given file
+--report            : write the size of every file at each build step, per file and per directory, as JSON to the given file
+                      and print it as a table
+-j, --jobs          : number of worker processes used for minifying and compressing files, 0 uses all CPUs
+                      (overrides "jobs" of the configuration)
+
+    python3 microfreezer.py serve <options>
+
+runs the build daemon, see microfreezer_client.py. Options:
+-c, --config        : the configuration of the builds that do not send one
+--socket            : the path of the unix socket (default: $XDG_RUNTIME_DIR/microfreezer.sock)
+--workers           : number of builds that run at the same time (default: 2)
+-j, --jobs          : number of worker processes shared by the builds, 0 uses all CPUs (default: 0)
 """
     logging.error(message)
     quit()
 
 
+def runServe(argumentList):
+    from aux_files.server import defaultSocketPath
+
+    socketPath = defaultSocketPath()
+    config_file = None
+    workers = 2
+    jobs = 0
+    is_verbose = False
+    try:
+        arguments, _ = getopt.getopt(argumentList, "hvc:j:", ["help", "verbose", "config=", "socket=", "workers=", "jobs="])
+        for currentArgument, currentValue in arguments:
+            if currentArgument in ("-c", "--config"):
+                config_file = str(currentValue)
+            elif currentArgument == "--socket":
+                socketPath = str(currentValue)
+            elif currentArgument == "--workers":
+                workers = int(currentValue)
+            elif currentArgument in ("-j", "--jobs"):
+                jobs = int(currentValue)
+            elif currentArgument in ("-v", "--verbose"):
+                is_verbose = True
+            elif currentArgument in ("-h", "--help"):
+                showHelp()
+    except (getopt.error, ValueError) as err:
+        logging.error(str(err))
+        showHelp()
+
+    Config.setupLogging(is_verbose)
+    config_obj = Config(config_file) if config_file is not None else Config({})
+    serve(socketPath, config_obj, workers, jobs)
+
+
 if __name__ == "__main__":
     from sys import argv
 
+    if len(argv) > 1 and argv[1] == "serve":
+        runServe(argv[2:])
+        sys.exit(0)
+
     argumentList = sys.argv[1:]
-    options = "hvc:s:d:"
-    long_options = ["help", "verbose", "config=", "ota-package", "source=", "destination="]
+    options = "hvc:s:d:j:"
+    long_options = [
+        "help", "verbose", "config=", "ota-package", "source=", "destination=", "jobs=", "no-cache", "base=", "watch", "report=",
+        "profile", "profile-top=", "profile-trace=", "profile-cprofile=",
+    ]
     config_file = None
     is_ota_package = False
     is_verbose = False
     sourceDir = None
     destDir = None
+    jobs = None
+    use_cache = True
+    base_manifest = None
+    watch = False
+    report_file = None
+    profile = False
+    profile_top = 10
+    trace_file = None
+    cprofile_file = None
 
     try:
         arguments, values = getopt.getopt(argumentList, options, long_options)
@@ -382,6 +1841,25 @@ if __name__ == "__main__":
                 sourceDir = str(currentValue)
             elif currentArgument in ("-d", "--destination"):
                 destDir = str(currentValue)
+            elif currentArgument in ("-j", "--jobs"):
+                jobs = int(currentValue)
+            elif currentArgument == "--base":
+                base_manifest = str(currentValue)
+            elif currentArgument == "--no-cache":
+                use_cache = False
+            elif currentArgument == "--watch":
+                watch = True
+            elif currentArgument == "--report":
+                report_file = str(currentValue)
+            elif currentArgument == "--profile":
+                profile = True
+            elif currentArgument == "--profile-top":
+                profile_top = int(currentValue)
+            elif currentArgument == "--profile-trace":
+                profile = True
+                trace_file = str(currentValue)
+            elif currentArgument == "--profile-cprofile":
+                cprofile_file = str(currentValue)
             elif currentArgument in ("-h", "--help"):
                 showHelp()
 
@@ -391,7 +1869,7 @@ if __name__ == "__main__":
             elif len(argv) < 3:
                 raise getopt.error("not enough arguments provided")
 
-    except getopt.error as err:
+    except (getopt.error, ValueError) as err:
         # output error, and return with an error code
         logging.error(str(err))
         showHelp()
@@ -403,8 +1881,31 @@ if __name__ == "__main__":
     logging.debug("source: {}, destination: {}".format(sourceDir, destDir))
 
     freezer = MicroFreezer(config_obj)
+    if jobs is not None:
+        freezer.jobs = jobs
+    if not use_cache:
+        freezer.enableCache = False
 
-    if is_ota_package:
-        freezer.run_package(sourceDir, destDir)
+    if watch:
+        freezer.watch(sourceDir, destDir, is_ota_package, base_manifest)
     else:
-        freezer.run(sourceDir, destDir)
+        if profile:
+            profiler.active = profiler.Profiler(profile_top)
+        cprofile = None
+        if cprofile_file is not None:
+            import cProfile
+
+            cprofile = cProfile.Profile()
+            cprofile.enable()
+        result = freezer.build(sourceDir, destDir, is_ota_package, base_manifest)
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(cprofile_file)
+        if profiler.active is not None:
+            profiler.active.logSummary()
+            if trace_file is not None:
+                profiler.active.writeChromeTrace(trace_file)
+        if report_file is not None:
+            writeReport(result, report_file)
+        if not result.ok:
+            sys.exit(1)
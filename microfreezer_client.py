@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2021, insigh.io
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Sends a build to the daemon started with "python3 microfreezer.py serve", with the same arguments
+# as microfreezer.py, and exits with status 1 when the build fails.
+
+import getopt
+import json
+import logging
+import os
+import sys
+from os.path import abspath
+
+from aux_files.server import defaultSocketPath, request
+
+
+def showHelp():
+    message = """usage:
+    python3 microfreezer_client.py <options> <path-to-project> <path-to-output-folder>
+or
+    python3 microfreezer_client.py <options> -s <path-to-project> -d <path-to-output-folder>
+or
+    python3 microfreezer_client.py --stats
+
+Options and arguments:
+-h, --help          : print this help message
+-v, --verbose       : print the whole result of the build
+-c, --config        : explicitly specify configuration file path, if omitted "./config.json" is used when it exists,
+                      or else the configuration of the daemon
+-s, --source        : the path to the source directory of the project
+-d, --destination   : the path to the destination folder where all the generated files will be placed
+--ota-package       : generate OTA package instead, if omitted it will generate the files needed for micropython freezing
+--base              : path to the package_manifest.json of a previous build, creates a delta OTA package against it
+--no-cache          : do not use the build cache of minified and compressed files
+--socket            : the path of the unix socket of the daemon (default: $XDG_RUNTIME_DIR/microfreezer.sock)
+--stats             : print the statistics of the daemon
+"""
+    logging.error(message)
+    sys.exit(2)
+
+
+if __name__ == "__main__":
+    from sys import argv
+
+    logging.basicConfig(format="%(asctime)s: [%(levelname)s]: %(message)s", level=logging.INFO)
+    options = "hvc:s:d:j:"
+    long_options = [
+        "help", "verbose", "config=", "ota-package", "source=", "destination=", "jobs=", "no-cache", "base=", "socket=", "stats",
+    ]
+    config_file = "config.json" if os.path.isfile("config.json") else None
+    is_ota_package = False
+    is_verbose = False
+    sourceDir = None
+    destDir = None
+    use_cache = True
+    base_manifest = None
+    socketPath = defaultSocketPath()
+    stats = False
+
+    try:
+        arguments, values = getopt.getopt(argv[1:], options, long_options)
+        for currentArgument, currentValue in arguments:
+            if currentArgument in ("-c", "--config"):
+                config_file = str(currentValue)
+            elif currentArgument == "--ota-package":
+                is_ota_package = True
+            elif currentArgument in ("-v", "--verbose"):
+                is_verbose = True
+            elif currentArgument in ("-s", "--source"):
+                sourceDir = str(currentValue)
+            elif currentArgument in ("-d", "--destination"):
+                destDir = str(currentValue)
+            elif currentArgument in ("-j", "--jobs"):
+                logging.info("the daemon uses its own worker processes, ignoring {}".format(currentArgument))
+            elif currentArgument == "--base":
+                base_manifest = str(currentValue)
+            elif currentArgument == "--no-cache":
+                use_cache = False
+            elif currentArgument == "--socket":
+                socketPath = str(currentValue)
+            elif currentArgument == "--stats":
+                stats = True
+            elif currentArgument in ("-h", "--help"):
+                showHelp()
+
+        if not stats and (not sourceDir or not destDir):
+            if len(values) < 2:
+                raise getopt.error("not enough arguments provided")
+            sourceDir = values[-2]
+            destDir = values[-1]
+    except (getopt.error, ValueError) as err:
+        logging.error(str(err))
+        showHelp()
+
+    try:
+        if stats:
+            print(json.dumps(request(socketPath, {"command": "stats"}), indent=1))
+            sys.exit(0)
+
+        response = request(
+            socketPath,
+            {
+                "command": "build",
+                "source": abspath(sourceDir),
+                "destination": abspath(destDir),
+                "config": abspath(config_file) if config_file is not None else None,
+                "otaPackage": is_ota_package,
+                "base": abspath(base_manifest) if base_manifest is not None else None,
+                "noCache": not use_cache,
+            },
+        )
+    except OSError as e:
+        logging.error("unable to reach the build daemon at {}: {}".format(socketPath, e))
+        sys.exit(1)
+
+    if is_verbose:
+        print(json.dumps(response, indent=1))
+    for error in response["errors"]:
+        logging.error(error)
+    if not response["ok"]:
+        sys.exit(1)
+    logging.info(
+        "built {} files, md5sum: {}, in {:.3f} s ({:.3f} s queued), cache hits: {}, misses: {}".format(
+            len(response["files"]),
+            response["md5sum"],
+            response["latency"],
+            response["queueTime"],
+            response["cacheHits"],
+            response["cacheMisses"],
+        )
+    )
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, TESTS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "emulator"))
+
+PROJECT_FILES = {
+    "main.py": "import lib.util\n\nprint(lib.util.greet('device'))\n",
+    "boot.py": "# boot\nimport gc\n",
+    "lib/util.py": "def greet(name):\n    return 'hello ' + name\n" * 20,
+    "lib/data.json": '{"interval": 60, "name": "sensor"}\n',
+    "overlay/lib/data.json": '{"interval": 10, "name": "fast sensor"}\n',
+}
+
+
+# a small project with an overlay folder for the variants
+@pytest.fixture
+def project(tmp_path):
+    sourceDir = tmp_path / "project"
+    for path, content in PROJECT_FILES.items():
+        (sourceDir / path).parent.mkdir(parents=True, exist_ok=True)
+        (sourceDir / path).write_text(content)
+    return sourceDir
+
+
+@pytest.fixture
+def esp32Config(tmp_path):
+    return {
+        "targetESP32": True,
+        "targetPycom": False,
+        "minify": False,
+        "cacheDir": str(tmp_path / "cache"),
+        "pipelinePlugins": ["strip_plugin"],
+        "pipeline": [{"match": "*.py", "stages": ["strip_comments"]}],
+    }
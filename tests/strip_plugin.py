@@ -0,0 +1,13 @@
+# a pipeline stage for the tests, registered through the "pipelinePlugins" key
+from aux_files.pipeline import registerStage
+
+# the source files of the calls of the stage, in the process of the tests
+calls = []
+
+
+@registerStage("strip_comments")
+def stripComments(file, options):
+    calls.append(file["sourceFile"])
+    lines = file["payload"].split(b"\n")
+    file["payload"] = b"\n".join(line for line in lines if not line.lstrip().startswith(b"#"))
+    return file
@@ -0,0 +1,186 @@
+import json
+import os
+import subprocess
+import sys
+from os.path import join
+
+import pytest
+
+import microfreezer
+import strip_plugin
+from aux_files.cache import BuildCache
+from aux_files.config import Config
+from conftest import PROJECT_FILES, REPO_DIR
+
+
+def test_build(project, esp32Config, tmp_path):
+    result = microfreezer.build(str(project), str(tmp_path / "out"), esp32Config)
+
+    assert result.ok, result.errors
+    assert result.md5sum is not None
+    assert (tmp_path / "out" / "_todefrost" / "microwave.py").is_file()
+
+
+def test_build_records_configuration_errors(project, esp32Config, tmp_path):
+    config = dict(esp32Config, pipeline=[{"match": "*.py", "stages": ["no_such_stage"]}])
+    result = microfreezer.build(str(project), str(tmp_path / "out"), config)
+
+    assert not result.ok
+    assert result.errors == ["ValueError: unknown pipeline stage: no_such_stage"]
+
+
+def test_build_records_missing_configuration_file(project, tmp_path):
+    result = microfreezer.build(str(project), str(tmp_path / "out"), str(tmp_path / "missing.json"))
+
+    assert not result.ok
+    assert result.errors[0].startswith("FileNotFoundError")
+
+
+def outputContents(destDir):
+    return {
+        path.relative_to(destDir).as_posix(): path.read_bytes() for path in sorted(destDir.rglob("*")) if path.is_file()
+    }
+
+
+def test_second_build_hits_the_cache(project, esp32Config, tmp_path):
+    cold = microfreezer.build(str(project), str(tmp_path / "cold"), esp32Config)
+    warm = microfreezer.build(str(project), str(tmp_path / "warm"), esp32Config)
+
+    assert cold.ok and warm.ok
+    assert (cold.cacheHits, cold.cacheMisses) == (0, len(PROJECT_FILES))
+    assert (warm.cacheHits, warm.cacheMisses) == (len(PROJECT_FILES), 0)
+    assert warm.md5sum == cold.md5sum
+    assert outputContents(tmp_path / "warm") == outputContents(tmp_path / "cold")
+
+
+def test_changed_file_misses_the_cache(project, esp32Config, tmp_path):
+    microfreezer.build(str(project), str(tmp_path / "cold"), esp32Config)
+    (project / "lib" / "util.py").write_text("def greet(name):\n    return 'hi ' + name\n")
+    result = microfreezer.build(str(project), str(tmp_path / "changed"), esp32Config)
+
+    assert result.ok
+    assert (result.cacheHits, result.cacheMisses) == (len(PROJECT_FILES) - 1, 1)
+
+
+def test_changed_options_miss_the_cache(project, esp32Config, tmp_path):
+    microfreezer.build(str(project), str(tmp_path / "cold"), esp32Config)
+    result = microfreezer.build(str(project), str(tmp_path / "level9"), dict(esp32Config, compressionLevels=[9]))
+
+    assert result.ok
+    assert (result.cacheHits, result.cacheMisses) == (0, len(PROJECT_FILES))
+
+
+def cacheSize(cacheDir):
+    return sum(path.stat().st_size for path in cacheDir.rglob("*") if path.is_file())
+
+
+def test_cache_eviction_keeps_the_recently_used_entries(tmp_path):
+    cache = BuildCache(str(tmp_path / "cache"), max_size=3000)
+    keys = [cache.key(str(index).encode()) for index in range(5)]
+    for age, key in enumerate(keys):
+        cache.put(key, bytes(1000))
+        os.utime(cache.entryPath(key), (1000 + age, 1000 + age))
+    # reading an entry makes it the most recently used one
+    assert cache.get(keys[0]) is not None
+    cache.evict()
+
+    assert cacheSize(tmp_path / "cache") <= 3000
+    assert [cache.get(key) is not None for key in keys] == [True, False, False, True, True]
+
+
+def test_build_keeps_the_cache_under_its_size(project, esp32Config, tmp_path):
+    (project / "lib" / "blob.bin").write_bytes(os.urandom(8192))
+    config = dict(esp32Config, cacheMaxSize=4096)
+    result = microfreezer.build(str(project), str(tmp_path / "out"), config)
+
+    assert result.ok
+    assert 0 < cacheSize(tmp_path / "cache") <= 4096
+
+
+def outputTimes(destDir):
+    return {path: os.stat(join(destDir, path)).st_mtime for path in outputContents(destDir)}
+
+
+# the rebuilds of --watch rewrite only the outputs whose contents changed and remove the ones of deleted files
+@pytest.mark.parametrize("layout", ["module", "bundle"])
+def test_incremental_rebuild(project, esp32Config, tmp_path, layout):
+    (project / "lib" / "big.bin").write_bytes(os.urandom(4096))
+    config = dict(esp32Config, layout=layout, bundleMaxSize=1024)
+    destDir = tmp_path / "out"
+    freezer = microfreezer.MicroFreezer(Config(config))
+    freezer.incremental = True
+    assert freezer.build(str(project), str(destDir)).ok
+    before = outputContents(destDir)
+    for path in before:
+        os.utime(join(destDir, path), (1000, 1000))
+
+    (project / "lib" / "util.py").write_text("def greet(name):\n    return 'hi ' + name\n")
+    (project / "overlay" / "lib" / "data.json").unlink()
+    result = freezer.build(str(project), str(destDir))
+    assert result.ok, result.errors
+    after = outputContents(destDir)
+    times = outputTimes(destDir)
+
+    assert "overlay/lib/data.json" not in {entry["path"] for entry in result.files}
+    assert not any(b"overlay/lib/data.json" in contents for contents in after.values())
+    assert set(after) <= set(before)
+    unchanged = [path for path in after if after[path] == before[path]]
+    changed = [path for path in after if after[path] != before[path]]
+    assert "_todefrost/microwave.py" in unchanged
+    assert any(b"lib/big.bin" in after[path] for path in unchanged)
+    assert "_todefrost/package_md5sum.py" in changed
+    assert all(times[path] == 1000 for path in unchanged)
+    assert all(times[path] != 1000 for path in changed)
+
+
+# each file goes through its pipeline stages once for all the targets
+def test_targets_share_one_transform_pass(project, esp32Config, tmp_path):
+    config = dict(
+        esp32Config,
+        enableCache=False,
+        targets=[
+            {"name": "pycom", "targetPycom": True, "targetESP32": False},
+            {"name": "esp32", "targetPycom": False, "targetESP32": True},
+            {"name": "esp32-ota", "type": "ota", "targetPycom": False, "targetESP32": True},
+        ],
+    )
+    del strip_plugin.calls[:]
+    result = microfreezer.build(str(project), str(tmp_path / "out"), config)
+
+    assert result.ok, result.errors
+    assert set(result.targets) == {"pycom", "esp32", "esp32-ota"}
+    pythonFiles = [path for path in PROJECT_FILES if path.endswith(".py")]
+    assert sorted(os.path.relpath(path, project).replace(os.sep, "/") for path in strip_plugin.calls) == sorted(pythonFiles)
+    assert (tmp_path / "out" / "pycom" / "Custom" / "_todefrost" / "microwave.py").is_file()
+    assert (tmp_path / "out" / "esp32" / "_todefrost" / "microwave.py").is_file()
+    assert result.targets["esp32-ota"].package is not None
+
+
+# an exceeded budget fails the build with exit status 1, after its outputs are written so that they can be inspected
+@pytest.mark.parametrize(
+    "budget, options, output",
+    [
+        ({"frozenBudget": 100}, [], "_todefrost/microwave.py"),
+        ({"otaPackageBudget": 100}, ["--ota-package"], "package_manifest.json"),
+    ],
+)
+def test_exceeded_budget_fails_the_build(project, esp32Config, tmp_path, budget, options, output):
+    config = dict(esp32Config, **budget)
+    del config["pipeline"], config["pipelinePlugins"]
+    (key,) = budget
+    configFile = tmp_path / "config.json"
+    configFile.write_text(json.dumps(config))
+    destDir = tmp_path / "out"
+    command = [sys.executable, join(REPO_DIR, "microfreezer.py"), "-c", str(configFile), "-s", str(project), "-d", str(destDir)]
+    process = subprocess.run(command + options, capture_output=True, text=True)
+
+    assert process.returncode == 1
+    assert "exceeds the {}".format(key) in process.stderr
+    assert (destDir / output).is_file()
+
+    result = microfreezer.build(str(project), str(tmp_path / "api"), config, otaPackage=bool(options))
+    assert not result.ok
+    assert len(result.errors) == 1 and "exceeds the" in result.errors[0]
+
+    config[key] = 1024 * 1024
+    assert microfreezer.build(str(project), str(tmp_path / "within"), config, otaPackage=bool(options)).ok
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+import microfreezer
+from conftest import PROJECT_FILES
+from device_emulator import DeviceEmulator, checkBudgets
+from transfer_harness import TransferHarness
+
+# the heap the emulator reports to gc.mem_free
+DEVICE_HEAP = 1024 * 1024
+LARGE_FILE_SIZE = 512 * 1024
+
+# the configuration, the flash root and the folder of a frozen build with the _todefrost folder, per platform
+PLATFORMS = {
+    "esp32": ({"targetESP32": True, "targetPycom": False}, "/", "."),
+    "pycom": ({"targetESP32": False, "targetPycom": True}, "/flash", "Custom"),
+}
+
+
+@pytest.fixture(params=sorted(PLATFORMS))
+def platform(request, esp32Config):
+    options, flashRoot, frozenFolder = PLATFORMS[request.param]
+    config = dict(esp32Config, **options)
+    # the files are installed as they are in the project
+    del config["pipeline"]
+    return config, flashRoot, frozenFolder
+
+
+def assertInstalled(emulator, flashRoot):
+    for path, content in PROJECT_FILES.items():
+        with open(emulator.hostPath(flashRoot + "/" + path)) as f:
+            assert f.read() == content, path
+
+
+def test_defrost_installs_the_project(project, platform, tmp_path):
+    config, flashRoot, frozenFolder = platform
+    destDir = tmp_path / "frozen"
+    result = microfreezer.build(str(project), str(destDir), config)
+    assert result.ok, result.errors
+
+    emulator = DeviceEmulator(str(tmp_path / "flash"), flashRoot)
+    report = emulator.defrost(str(destDir / frozenFolder))
+    assert report["error"] is None
+    assertInstalled(emulator, flashRoot)
+    assert {"{}/{}".format(flashRoot.rstrip("/"), path) for path in PROJECT_FILES} <= {f["path"] for f in report["files"]}
+
+    assert checkBudgets(report, max_heap=DEVICE_HEAP) == []
+    failures = checkBudgets(report, max_heap=1024)
+    assert len(failures) == 1 and failures[0].startswith("peak heap")
+
+
+def test_apply_package_installs_the_project(project, platform, tmp_path):
+    config, flashRoot, _ = platform
+    destDir = tmp_path / "ota"
+    result = microfreezer.build(str(project), str(destDir), config, otaPackage=True)
+    assert result.ok, result.errors
+
+    emulator = DeviceEmulator(str(tmp_path / "flash"), flashRoot)
+    report = emulator.applyPackage(str(destDir))
+    assert report["error"] is None
+    assert report["reset"]
+    assertInstalled(emulator, flashRoot)
+
+
+# the package is extracted through a small copy buffer, so the heap does not grow with the size of its files
+def test_apply_package_heap_budget(project, platform, tmp_path):
+    config, flashRoot, _ = platform
+    reports = {}
+    for name in ("small", "large"):
+        if name == "large":
+            (project / "lib" / "blob.bin").write_bytes(os.urandom(LARGE_FILE_SIZE))
+        destDir = tmp_path / name
+        result = microfreezer.build(str(project), str(destDir), config, otaPackage=True)
+        assert result.ok, result.errors
+        reports[name] = DeviceEmulator(str(tmp_path / (name + "_flash")), flashRoot).applyPackage(str(destDir))
+
+    assert reports["large"]["bytesWritten"] > LARGE_FILE_SIZE
+    budget = reports["small"]["peakHeap"] + LARGE_FILE_SIZE // 8
+    assert checkBudgets(reports["large"], max_heap=budget) == []
+
+
+@pytest.mark.parametrize("scenario", ["complete", "truncated", "corrupted", "truncatedHeader"])
+@pytest.mark.parametrize("compressed", [True, False])
+def test_chunked_package_transfer(project, platform, tmp_path, scenario, compressed):
+    config, flashRoot, _ = platform
+    config = dict(config, otaChunkSize=256, enableZlibCompression=compressed)
+    destDir = tmp_path / "ota"
+    result = microfreezer.build(str(project), str(destDir), config, otaPackage=True)
+    assert result.ok, result.errors
+
+    harness = TransferHarness(str(destDir), flashRoot)
+    assert len(harness.header["chunks"]) >= 2
+    assert getattr(harness, scenario)() == []
+
+
+# the files changed by an OTA package, or by the application, are installed again by the next firmware
+def test_defrost_restores_files_changed_after_it(project, esp32Config, tmp_path):
+    config = dict(esp32Config)
+    del config["pipeline"]
+    emulator = DeviceEmulator(str(tmp_path / "flash"))
+    frozen = microfreezer.build(str(project), str(tmp_path / "frozen"), config)
+    assert frozen.ok, frozen.errors
+    assert emulator.defrost(str(tmp_path / "frozen"))["error"] is None
+
+    (project / "lib" / "data.json").write_text('{"interval": 5}\n')
+    ota = microfreezer.build(str(project), str(tmp_path / "ota"), config, otaPackage=True)
+    assert ota.ok, ota.errors
+    assert emulator.applyPackage(str(tmp_path / "ota"))["reset"]
+
+    with open(emulator.hostPath("/main.py"), "a") as f:
+        f.write("print('changed on the device')\n")
+    report = emulator.defrost(str(tmp_path / "frozen"))
+    assert report["error"] is None
+    assertInstalled(emulator, "/")
+
+    # an unchanged flash is left alone
+    report = emulator.defrost(str(tmp_path / "frozen"))
+    assert report["error"] is None
+    assert not {"/main.py", "/lib/data.json"} & {f["path"] for f in report["files"]}
+
+
+# a delta against another base is refused and removed, so a full package pushed after it is applied next
+def test_refused_delta_is_removed(project, esp32Config, tmp_path):
+    config = dict(esp32Config)
+    del config["pipeline"]
+    base = microfreezer.build(str(project), str(tmp_path / "base"), config, otaPackage=True)
+    assert base.ok, base.errors
+    (project / "lib" / "data.json").write_text('{"interval": 5}\n')
+    manifest = str(tmp_path / "base" / "package_manifest.json")
+    delta = microfreezer.build(str(project), str(tmp_path / "delta"), config, otaPackage=True, baseManifestFile=manifest)
+    assert delta.ok, delta.errors
+
+    # the device has none of the base package installed
+    emulator = DeviceEmulator(str(tmp_path / "flash"))
+    report = emulator.applyPackage(str(tmp_path / "delta"))
+    assert report["error"] is None
+    assert not report["reset"]
+    assert not any(f.endswith((".tar", ".tar.gz")) for f in os.listdir(emulator.hostPath("/")))
+
+    report = emulator.applyPackage(str(tmp_path / "base"))
+    assert report["reset"]
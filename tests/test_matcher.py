@@ -0,0 +1,95 @@
+import pytest
+
+import microfreezer
+from aux_files.matcher import ExcludeList, PathMatcher
+
+# (patterns, path, isDirectory, excluded), following the excludeList rules of the README
+PATH_MATCHER_CASES = [
+    # a plain name matches a file or folder at any depth
+    (["README.md"], "README.md", False, True),
+    (["README.md"], "lib/README.md", False, True),
+    (["README.md"], "lib/README.md.bak", False, False),
+    ([".git"], ".git", True, True),
+    # the files inside a matching folder match too
+    ([".git"], ".git/config", False, True),
+    (["tests"], "lib/tests/test_a.py", False, True),
+    # a pattern containing a "/" matches from the project root, a leading "/" only anchors it
+    (["/build"], "build", True, True),
+    (["/build"], "lib/build", True, False),
+    (["docs/*.md"], "docs/index.md", False, True),
+    (["docs/*.md"], "lib/docs/index.md", False, False),
+    (["lib/build"], "lib/build/out.bin", False, True),
+    # "*" and "?" do not match "/"
+    (["docs/*.md"], "docs/api/index.md", False, False),
+    (["*.py"], "lib/a.py", False, True),
+    (["lib/?.py"], "lib/a.py", False, True),
+    (["lib/?.py"], "lib/ab.py", False, False),
+    # "**/" matches any number of folders and a trailing "/**" everything inside a folder
+    (["**/cache"], "cache", True, True),
+    (["**/cache"], "a/b/cache", True, True),
+    (["lib/**/test_*.py"], "lib/test_a.py", False, True),
+    (["lib/**/test_*.py"], "lib/x/y/test_a.py", False, True),
+    (["lib/**"], "lib/a/b.py", False, True),
+    (["lib/**"], "lib", True, False),
+    # character classes, "[!...]" negated
+    (["log[0-9].txt"], "log1.txt", False, True),
+    (["log[0-9].txt"], "logx.txt", False, False),
+    (["log[!0-9].txt"], "logx.txt", False, True),
+    (["log[!0-9].txt"], "log1.txt", False, False),
+    # a trailing "/" matches folders only
+    (["build/"], "build", True, True),
+    (["build/"], "build", False, False),
+    (["build/"], "lib/build/out.bin", False, True),
+    # "!" includes again what a previous pattern excluded, the last matching pattern wins
+    (["*.log", "!important.log"], "important.log", False, False),
+    (["*.log", "!important.log"], "debug.log", False, True),
+    (["!important.log", "*.log"], "important.log", False, True),
+    (["lib/", "!lib/"], "lib", True, False),
+    # comments, blank lines and escapes
+    (["# comment", "", "   "], "# comment", False, False),
+    (["\\#notes.txt"], "#notes.txt", False, True),
+    (["\\!bang.txt"], "!bang.txt", False, True),
+    (["trailing.txt   "], "trailing.txt", False, True),
+]
+
+
+@pytest.mark.parametrize("patterns, path, isDirectory, excluded", PATH_MATCHER_CASES)
+def test_path_matcher(patterns, path, isDirectory, excluded):
+    assert PathMatcher(patterns).match(path, isDirectory) is excluded
+
+
+# (entries, path, relativePath, excluded): plain entries match as substrings of the path, the others as patterns
+EXCLUDE_LIST_CASES = [
+    (["vendor"], "/home/me/project/lib/vendor/x.py", "lib/vendor/x.py", True),
+    (["vendor"], "/home/me/project/lib/other.py", "lib/other.py", False),
+    (["lib/vendor/**"], "/home/me/project/lib/vendor/x.py", "lib/vendor/x.py", True),
+    (["lib/vendor/**"], "/home/me/vendor/lib/x.py", "lib/x.py", False),
+    (["/main.py"], "/home/me/project/main.py", "main.py", True),
+    (["/main.py"], "/home/me/project/lib/main.py", "lib/main.py", False),
+    ([], "/home/me/project/main.py", "main.py", False),
+]
+
+
+@pytest.mark.parametrize("entries, path, relativePath, excluded", EXCLUDE_LIST_CASES)
+def test_exclude_list(entries, path, relativePath, excluded):
+    assert ExcludeList(entries).match(path, relativePath) is excluded
+
+
+# excluded folders are skipped during the walk, so a "!" pattern can not include again a file inside them
+def test_excluded_folders_are_not_walked(project, esp32Config, tmp_path):
+    (project / "build").mkdir()
+    (project / "build" / "keep.txt").write_text("kept?\n")
+    (project / "debug.log").write_text("debug\n")
+    (project / "important.log").write_text("important\n")
+    (project / ".gitignore").write_text("*.log\n")
+    config = dict(
+        esp32Config,
+        useGitignore=True,
+        excludeList=[".gitignore", "overlay/", "build/", "!build/keep.txt", "!important.log"],
+    )
+    result = microfreezer.build(str(project), str(tmp_path / "out"), config, otaPackage=True)
+
+    assert result.ok, result.errors
+    assert sorted(entry["path"] for entry in result.files) == [
+        "boot.py", "important.log", "lib/data.json", "lib/util.py", "main.py"
+    ]
@@ -0,0 +1,59 @@
+import threading
+
+import aux_files.profiler as profiler
+import microfreezer
+
+
+def test_profiled_call_keeps_the_build_profiler():
+    build = profiler.active = profiler.Profiler()
+    started = threading.Event()
+    checked = threading.Event()
+    profiled = {}
+
+    def task(data):
+        started.set()
+        checked.wait(5)
+        return profiler.call("inner", len, data)
+
+    def runTask():
+        profiled["result"], profiled["events"] = profiler.profiledCall(task, b"abc")
+
+    try:
+        thread = threading.Thread(target=runTask)
+        thread.start()
+        started.wait(5)
+        # a task running in another thread leaves the profiler of this thread alone
+        assert profiler.active is build
+        assert profiler.current() is build
+        checked.set()
+        thread.join()
+    finally:
+        profiler.active = None
+
+    assert profiled["result"] == 3
+    assert [event["name"] for event in profiled["events"]] == ["inner", "task"]
+    assert build.events == []
+
+
+def test_concurrent_builds_keep_the_build_profiler(project, esp32Config, tmp_path):
+    build = profiler.active = profiler.Profiler()
+    results = {}
+    taskProfilers = {}
+
+    def freeze(name):
+        results[name] = microfreezer.build(str(project), str(tmp_path / name), esp32Config, otaPackage=name.startswith("ota"))
+        taskProfilers[name] = getattr(profiler.taskProfiler, "profiler", None)
+
+    try:
+        threads = [threading.Thread(target=freeze, args=(name,)) for name in ("frozen1", "frozen2", "ota1", "ota2")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        profiler.active = None
+
+    assert all(result.ok for result in results.values())
+    assert all(taskProfiler is None for taskProfiler in taskProfilers.values())
+    assert profiler.current() is None
+    assert "strip_comments" in build.stages()
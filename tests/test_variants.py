@@ -0,0 +1,30 @@
+import microfreezer
+
+
+def variantsConfig(config):
+    config = dict(config)
+    config["variants"] = [
+        {"name": "standard", "remove": ["overlay/**"]},
+        {"name": "fast", "overlay": "overlay", "remove": ["overlay/**"]},
+    ]
+    return config
+
+
+def test_variants_share_the_store(project, esp32Config, tmp_path):
+    result = microfreezer.build(str(project), str(tmp_path / "out"), variantsConfig(esp32Config))
+
+    assert result.ok, result.errors
+    assert set(result.variants) == {"standard", "fast"}
+    assert result.variants["standard"].md5sum != result.variants["fast"].md5sum
+    assert result.dedupRatio > 1.0
+
+
+def test_warm_variant_build_hits_the_cache(project, esp32Config, tmp_path):
+    config = variantsConfig(esp32Config)
+    cold = microfreezer.build(str(project), str(tmp_path / "cold"), config)
+    warm = microfreezer.build(str(project), str(tmp_path / "warm"), config)
+
+    assert cold.ok and warm.ok
+    assert cold.cacheMisses > 0
+    assert warm.cacheHits > 0
+    assert warm.cacheMisses == 0